@@ -1,17 +1,30 @@
 from flask import Flask
-from flask_mysqldb import MySQL
 from flask_login import LoginManager
 from config import Config
+from app.cache import ResponseCache
+from app.db import Database
+from app.instrument import Instrumentation
+from app.jobs import JobQueue
+from app.search import SearchIndex
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-mysql = MySQL(app)
+db = Database(app)
+page_cache = ResponseCache(app)
+search_index = SearchIndex()
+jobs = JobQueue(app, db)
+instrumentation = Instrumentation(app, db)
+instrumentation.add_gauge('page_cache_hits_total', 'Page cache hits.', lambda: page_cache.hits, 'counter')
+instrumentation.add_gauge('page_cache_misses_total', 'Page cache misses.', lambda: page_cache.misses, 'counter')
+instrumentation.add_gauge('jobs_queue_depth', 'Background jobs waiting to run.', lambda: jobs.stats()['depth'])
+instrumentation.add_gauge('db_pool_in_use', 'Pooled connections checked out.', lambda: db.pool.in_use)
+instrumentation.add_gauge('db_pool_idle', 'Pooled connections idle.', lambda: db.pool.idle())
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
 # Import routes at the end to avoid circular imports
-from app import routes
+from app import routes, commands, tasks
 
 
 
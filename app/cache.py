@@ -0,0 +1,370 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import g, make_response, request, session, Response
+from flask_login import current_user
+
+# stored_at is time.time_ns() when rendering began, so a write that lands
+# while the page renders still makes it stale; expires is a Unix time.
+CachedPage = namedtuple('CachedPage', 'body mimetype etag last_modified tags stored_at expires')
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sizeof(key, page):
+        return len(key) + len(page.body) + 256
+
+    def get(self, key):
+        with self._lock:
+            page = self._entries.get(key)
+            if page is not None:
+                self._entries.move_to_end(key)
+            return page
+
+    def set(self, key, page):
+        size = self._sizeof(key, page)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._delete(key)
+            self._entries[key] = page
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old_page = self._entries.popitem(last=False)
+                self.size -= self._sizeof(old_key, old_page)
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        page = self._entries.pop(key, None)
+        if page is not None:
+            self.size -= self._sizeof(key, page)
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class FileSystemCache:
+    # Shared between worker processes; each entry is a pickled (key, page)
+    # pair in a file named after the key's hash. Every PRUNE_EVERY writes
+    # the oldest files are removed until the directory fits in max_bytes.
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _filename(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _load(self, filename):
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, TypeError, AttributeError):
+            # TypeError: written by an older version with fewer page fields.
+            return None
+
+    def get(self, key):
+        entry = self._load(self._filename(key))
+        return entry[1] if entry and entry[0] == key else None
+
+    def set(self, key, page):
+        if len(page.body) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, page), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._filename(key))
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def delete(self, key):
+        self._remove(self._filename(key))
+
+    @staticmethod
+    def _remove(filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    def _files(self):
+        files = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def prune(self):
+        # Evicts the least recently written files down to 90% of the cap,
+        # so crawling every ?cursor= cannot fill the disk.
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, filename in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            self._remove(filename)
+            total -= size
+
+    def items(self):
+        for _, _, filename in self._files():
+            entry = self._load(filename)
+            if entry:
+                yield entry
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            self._remove(os.path.join(self.path, name))
+
+
+class InvalidationLog:
+    # Invalidation shared by every process using the same directory, so a
+    # write handled by one worker (or a CLI command) evicts pages cached by
+    # all of them. Each tag hashes to one of BUCKETS marker files whose
+    # mtime is bumped on invalidation; a page is stale once any of its
+    # tags' markers, or the "all" marker, is not older than the page.
+    BUCKETS = 1024
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._all = os.path.join(path, 'all')
+
+    def _marker(self, tag):
+        digest = hashlib.sha1(tag.encode('utf-8')).digest()
+        return os.path.join(self.path, '%04d' % (int.from_bytes(digest[:4], 'big') % self.BUCKETS))
+
+    @staticmethod
+    def _touch(filename, now):
+        with open(filename, 'a'):
+            pass
+        os.utime(filename, ns=(now, now))
+
+    @staticmethod
+    def _mtime(filename):
+        try:
+            return os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def bump(self, tags):
+        now = time.time_ns()
+        for filename in {self._marker(tag) for tag in tags}:
+            self._touch(filename, now)
+
+    def bump_all(self):
+        self._touch(self._all, time.time_ns())
+
+    def is_stale(self, page):
+        markers = {self._marker(tag) for tag in page.tags}
+        markers.add(self._all)
+        return any(self._mtime(filename) >= page.stored_at for filename in markers)
+
+
+class TTLCache:
+    # Small object cache for values that may be briefly stale, like users.
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, page):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def items(self):
+        return []
+
+    def clear(self):
+        pass
+
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.invalidations = None
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_type = app.config.get('CACHE_TYPE', 'lru')
+        max_bytes = app.config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        self.ttl = app.config.get('CACHE_TTL', 300)
+        if cache_type == 'lru':
+            self.backend = LRUCache(max_bytes)
+        elif cache_type == 'filesystem':
+            self.backend = FileSystemCache(app.config.get('CACHE_DIR')
+                                           or os.path.join(app.instance_path, 'page_cache'), max_bytes)
+        elif cache_type == 'null':
+            self.backend = NullCache()
+            return
+        else:
+            raise ValueError('Unknown CACHE_TYPE: %s' % cache_type)
+        self.invalidations = InvalidationLog(app.config.get('CACHE_INVALIDATION_DIR')
+                                             or os.path.join(app.instance_path, 'page_cache_invalidations'))
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+        if isinstance(self.backend, LRUCache):
+            stats['entries'] = len(self.backend.items())
+            stats['size_bytes'] = self.backend.size
+            stats['max_bytes'] = self.backend.max_bytes
+        elif isinstance(self.backend, FileSystemCache):
+            stats['size_bytes'] = self.backend.size()
+            stats['max_bytes'] = self.backend.max_bytes
+        return stats
+
+    @staticmethod
+    def cacheable():
+        # Only anonymous GETs are shared; pages with pending flash messages
+        # or a logged in user's controls are rendered per request.
+        return (request.method in ('GET', 'HEAD')
+                and '_flashes' not in session
+                and not current_user.is_authenticated)
+
+    def cached(self, key_func):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.cacheable():
+                    return view(*args, **kwargs)
+                key = key_func(*args, **kwargs)
+                page = self.backend.get(key)
+                if page is not None and not self.fresh(page):
+                    page = None
+                if page is None:
+                    self._count('misses')
+                    started = time.time_ns()
+                    response = make_response(view(*args, **kwargs))
+                    tags = g.pop('cache_tags', set())
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    body = response.get_data()
+                    page = CachedPage(body, response.mimetype, hashlib.sha1(body).hexdigest(),
+                                      int(time.time()), frozenset(tags), started, time.time() + self.ttl)
+                    self.backend.set(key, page)
+                else:
+                    self._count('hits')
+                return self.respond(page)
+            return wrapper
+        return decorator
+
+    def fresh(self, page):
+        if page.expires < time.time():
+            return False
+        return self.invalidations is None or not self.invalidations.is_stale(page)
+
+    def respond(self, page):
+        response = Response(page.body, mimetype=page.mimetype)
+        response.set_etag(page.etag)
+        response.last_modified = page.last_modified
+        response.cache_control.no_cache = True
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            self._count('not_modified')
+        return response
+
+    def invalidate(self, keys=(), tags=()):
+        # Keys are dropped from this process's backend right away; tagged
+        # pages are found stale on their next hit in any process.
+        for key in keys:
+            self.backend.delete(key)
+        if tags and self.invalidations is not None:
+            self.invalidations.bump(tags)
+
+    def clear(self):
+        # Also empties the caches of other processes, including app
+        # workers when called from a CLI command.
+        self.backend.clear()
+        if self.invalidations is not None:
+            self.invalidations.bump_all()
+
+
+def cache_tag(*tags):
+    # Called from a cached view to mark which writes should evict the page.
+    g.setdefault('cache_tags', set()).update(tags)
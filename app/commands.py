@@ -0,0 +1,137 @@
+import os
+import pickle
+import threading
+import time
+
+import click
+
+from app import app, feeds, jobs, models, page_cache, search_index
+from app.render import render_post
+
+
+_search_index_lock = threading.Lock()
+_search_index_loader = None
+_search_index_caught_up = 0.0
+
+
+def search_index_path():
+    return app.config.get('SEARCH_INDEX_PATH') or os.path.join(app.instance_path, 'search_index.pickle')
+
+
+def build_search_index():
+    indexed_at = models.db_now()
+    search_index.clear()
+    for post_id, title, content in models.iter_posts():
+        search_index.add(post_id, title, content)
+    search_index.finish_build(indexed_at)
+
+
+def catch_up_search_index():
+    # Re-indexes posts written since the snapshot was taken or the last
+    # catch-up. Every worker process has its own index and job handlers only
+    # update the one they run in, so this is also how the others see writes.
+    # Deleted posts are dropped lazily, when a search turns them up (see
+    # run_search).
+    global _search_index_caught_up
+    indexed_at = models.db_now()
+    for post_id, title, content in models.iter_posts(updated_since=search_index.indexed_at):
+        search_index.add(post_id, title, content)
+    search_index.indexed_at = indexed_at
+    _search_index_caught_up = time.monotonic()
+
+
+def catch_up_in_background():
+    with app.app_context():
+        catch_up_search_index()
+
+
+def refresh_search_post(post_id):
+    # Writes that arrive while the index is loading are applied once it is.
+    if search_index.defer(post_id):
+        return
+    post = models.get_post_by_id(post_id)
+    if post is None:
+        search_index.remove(post_id)
+    else:
+        search_index.add(post[0], post[1], post[2])
+
+
+def load_search_index():
+    search_index.start_loading()
+    with app.app_context():
+        try:
+            search_index.load(search_index_path())
+        except (OSError, ValueError, pickle.UnpicklingError):
+            build_search_index()
+        else:
+            catch_up_search_index()
+        while True:
+            pending = search_index.finish_loading()
+            if not pending:
+                break
+            for post_id in pending:
+                refresh_search_post(post_id)
+
+
+def ensure_search_index():
+    # Returns whether the index is ready to search. Otherwise it is loaded,
+    # or built, in a background thread so no request waits on it. Once
+    # loaded, the same thread catches up with the database at most every
+    # SEARCH_CATCH_UP_INTERVAL seconds while searches keep using the index.
+    global _search_index_loader
+    interval = app.config.get('SEARCH_CATCH_UP_INTERVAL', 5)
+    if search_index.loaded and time.monotonic() - _search_index_caught_up < interval:
+        return True
+    with _search_index_lock:
+        if _search_index_loader is None or not _search_index_loader.is_alive():
+            target = catch_up_in_background if search_index.loaded else load_search_index
+            _search_index_loader = threading.Thread(target=target, name='search-index-loader', daemon=True)
+            _search_index_loader.start()
+    return search_index.loaded
+
+
+@app.cli.command('reindex')
+def reindex():
+    """Rebuild the search index from the posts table and save a snapshot."""
+    build_search_index()
+    path = search_index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    search_index.save(path)
+    click.echo('Indexed %d posts into %s' % (len(search_index), path))
+
+
+@app.cli.command('jobs-worker')
+def jobs_worker():
+    """Run persisted background jobs until interrupted."""
+    click.echo('Processing jobs every %ss with %d threads' % (jobs.poll_interval, jobs.workers))
+    jobs.run_worker()
+
+
+@app.cli.command('render-posts')
+@click.option('--all', 'render_all', is_flag=True, help='Re-render posts that already have HTML.')
+@click.option('--batch-size', default=500, show_default=True)
+def render_posts(render_all, batch_size):
+    """Backfill content_html and excerpts from the Markdown in content."""
+    rendered = 0
+    batch = []
+    for post_id, content, content_html in models.iter_posts('id, content, content_html', batch_size):
+        if content_html is not None and not render_all:
+            continue
+        batch.append(render_post(content) + (post_id,))
+        if len(batch) >= batch_size:
+            models.update_rendered(batch)
+            rendered += len(batch)
+            batch = []
+            click.echo('Rendered %d posts' % rendered)
+    if batch:
+        models.update_rendered(batch)
+        rendered += len(batch)
+    page_cache.clear()
+    click.echo('Rendered %d posts' % rendered)
+
+
+@app.cli.command('build-feeds')
+def build_feeds():
+    """Regenerate the RSS/Atom feeds and every sitemap shard."""
+    feeds.build_all()
+    click.echo('Wrote feeds and %d sitemap shard(s) to %s' % (feeds.shard_count(), feeds.feeds_dir()))
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+
+import MySQLdb
+from flask import g
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created', 'last_used')
+
+    def __init__(self, conn, now):
+        self.conn = conn
+        self.created = self.last_used = now
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=10, max_lifetime=3600, checkout_timeout=5.0,
+                 health_check_interval=30, clock=time.monotonic):
+        self._connect = connect
+        self._clock = clock
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        # LIFO so the warmest connections are reused and idle ones age out.
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise PoolTimeout('No database connection available after %ss' % self.checkout_timeout)
+        try:
+            pooled = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+        return pooled
+
+    def _checkout(self):
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return _PooledConnection(self._connect(), self._clock())
+            now = self._clock()
+            if now - pooled.created > self.max_lifetime:
+                self._close(pooled)
+                continue
+            if now - pooled.last_used > self.health_check_interval:
+                try:
+                    pooled.conn.ping()
+                except MySQLdb.Error:
+                    self._close(pooled)
+                    continue
+            return pooled
+
+    def release(self, pooled, discard=False):
+        try:
+            if not discard:
+                try:
+                    pooled.conn.rollback()
+                except MySQLdb.Error:
+                    discard = True
+            if discard or self._clock() - pooled.created > self.max_lifetime:
+                self._close(pooled)
+            else:
+                pooled.last_used = self._clock()
+                self._idle.put(pooled)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    @staticmethod
+    def _close(pooled):
+        try:
+            pooled.conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def idle(self):
+        return self._idle.qsize()
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+class Database:
+    # Hands each app context one pooled connection and one reusable cursor.
+    def __init__(self, app=None):
+        self.pool = None
+        self.cursor_wrapper = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+
+        def connect():
+            # TIMESTAMP columns are read and written in the session time zone;
+            # pin it to UTC, which feeds.py and posts_cli.py assume.
+            return MySQLdb.connect(host=config['MYSQL_HOST'],
+                                   port=config.get('MYSQL_PORT', 3306),
+                                   user=config['MYSQL_USER'],
+                                   passwd=config['MYSQL_PASSWORD'],
+                                   db=config['MYSQL_DB'],
+                                   charset='utf8mb4',
+                                   init_command="SET time_zone = '+00:00'")
+
+        self.pool = ConnectionPool(connect,
+                                   max_size=config.get('DB_POOL_SIZE', 10),
+                                   max_lifetime=config.get('DB_POOL_MAX_LIFETIME', 3600),
+                                   checkout_timeout=config.get('DB_POOL_TIMEOUT', 5.0),
+                                   health_check_interval=config.get('DB_POOL_HEALTH_CHECK', 30))
+        app.teardown_appcontext(self.teardown)
+
+    @property
+    def connection(self):
+        if '_db_conn' not in g:
+            g._db_conn = self.pool.acquire()
+        return g._db_conn.conn
+
+    def cursor(self):
+        if '_db_cursor' not in g:
+            cursor = self.connection.cursor()
+            g._db_cursor = self.cursor_wrapper(cursor) if self.cursor_wrapper else cursor
+        return g._db_cursor
+
+    def teardown(self, exc):
+        cursor = g.pop('_db_cursor', None)
+        if cursor is not None:
+            cursor.close()
+        pooled = g.pop('_db_conn', None)
+        if pooled is not None:
+            self.pool.release(pooled, discard=isinstance(exc, MySQLdb.OperationalError))
+
+    def query_one(self, sql, args=()):
+        cursor = self.cursor()
+        cursor.execute(sql, args)
+        return cursor.fetchone()
+
+    def query_all(self, sql, args=()):
+        cursor = self.cursor()
+        cursor.execute(sql, args)
+        return cursor.fetchall()
+
+    def execute(self, sql, args=()):
+        cursor = self.cursor()
+        cursor.execute(sql, args)
+        return cursor.rowcount
+
+    def commit(self):
+        self.connection.commit()
@@ -0,0 +1,180 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from datetime import timezone
+from email.utils import format_datetime
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from app import app, models
+
+FEED_SIZE = 20
+SITEMAP_SHARD_SIZE = 50000
+
+_lock = threading.Lock()
+
+
+def feeds_dir():
+    return app.config.get('FEEDS_DIR') or os.path.join(app.instance_path, 'feeds')
+
+def site_url():
+    return app.config.get('SITE_URL', 'http://localhost:5000').rstrip('/')
+
+def post_url(slug):
+    return '%s/post/%s' % (site_url(), quote(slug))
+
+def iso_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def write_file(name, data, compress=True):
+    # Writes the file with gzip/brotli variants and a content-hash ETag
+    # sidecar, each atomically, so readers never see a partial file.
+    directory = feeds_dir()
+    os.makedirs(directory, exist_ok=True)
+    data = data.encode('utf-8')
+    variants = [('', data)]
+    if compress:
+        variants.append(('.gz', gzip.compress(data, 9, mtime=0)))
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data)))
+        variants.append(('.etag', hashlib.sha1(data).hexdigest().encode('ascii')))
+    for suffix, content in variants:
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, os.path.join(directory, name + suffix))
+    if compress and brotli is None:
+        try:
+            os.remove(os.path.join(directory, name + '.br'))
+        except FileNotFoundError:
+            pass
+
+
+# RSS and Atom
+
+def render_rss(posts):
+    items = []
+    for post_id, title, excerpt, slug, created_at, updated_at in posts:
+        items.append('<item><title>%s</title><link>%s</link><guid isPermaLink="true">%s</guid>'
+                     '<pubDate>%s</pubDate><description>%s</description></item>'
+                     % (escape(title), escape(post_url(slug)), escape(post_url(slug)),
+                        format_datetime(created_at.replace(tzinfo=timezone.utc), usegmt=True), escape(excerpt)))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<rss version="2.0"><channel><title>Tech Blog</title><link>%s/</link>'
+            '<description>Latest posts from Tech Blog</description>%s</channel></rss>\n'
+            % (escape(site_url()), ''.join(items)))
+
+def render_atom(posts):
+    entries = []
+    for post_id, title, excerpt, slug, created_at, updated_at in posts:
+        entries.append('<entry><title>%s</title><link href="%s"/><id>%s</id><published>%s</published>'
+                       '<updated>%s</updated><summary>%s</summary></entry>'
+                       % (escape(title), escape(post_url(slug)), escape(post_url(slug)),
+                          iso_date(created_at), iso_date(updated_at or created_at), escape(excerpt)))
+    updated = iso_date(max(post[5] or post[4] for post in posts)) if posts else '1970-01-01T00:00:00Z'
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom"><title>Tech Blog</title>'
+            '<link href="%s/"/><link rel="self" href="%s/atom.xml"/><id>%s/</id><updated>%s</updated>%s</feed>\n'
+            % (escape(site_url()), escape(site_url()), escape(site_url()), updated, ''.join(entries)))
+
+def build_feeds():
+    posts = models.feed_posts(FEED_SIZE)
+    write_file('feed.xml', render_rss(posts))
+    write_file('atom.xml', render_atom(posts))
+    write_file('feed.ids', json.dumps([post[0] for post in posts]), compress=False)
+    return [post[0] for post in posts]
+
+def feed_ids():
+    try:
+        with open(os.path.join(feeds_dir(), 'feed.ids'), encoding='utf-8') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+# Sitemaps
+# Shards hold fixed id ranges, so a changed post only ever touches one
+# shard; sitemap.xml is the single shard or, above SITEMAP_SHARD_SIZE
+# posts, an index of all of them.
+
+def shard_of(post_id):
+    return (post_id - 1) // SITEMAP_SHARD_SIZE
+
+def render_urlset(posts):
+    urls = ''.join('<url><loc>%s</loc><lastmod>%s</lastmod></url>'
+                   % (escape(post_url(slug)), iso_date(updated_at or created_at))
+                   for slug, created_at, updated_at in posts)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</urlset>\n' % urls)
+
+def build_shard(shard):
+    posts = models.posts_in_id_range(shard * SITEMAP_SHARD_SIZE + 1, (shard + 1) * SITEMAP_SHARD_SIZE)
+    content = render_urlset(posts)
+    write_file('sitemap-%d.xml' % shard, content)
+    return content
+
+def build_sitemap_index(shard_count, single_shard=None):
+    if shard_count <= 1:
+        write_file('sitemap.xml', single_shard if single_shard is not None else build_shard(0))
+        return
+    sitemaps = ''.join('<sitemap><loc>%s/sitemap-%d.xml</loc></sitemap>' % (escape(site_url()), shard)
+                       for shard in range(shard_count))
+    write_file('sitemap.xml', '<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</sitemapindex>\n'
+               % sitemaps)
+
+def shard_count():
+    max_id = models.max_post_id()
+    return shard_of(max_id) + 1 if max_id else 1
+
+
+def build_all():
+    with _lock:
+        _build_all()
+
+def _build_all():
+    build_feeds()
+    count = shard_count()
+    first = None
+    for shard in range(count):
+        content = build_shard(shard)
+        if shard == 0:
+            first = content
+    build_sitemap_index(count, first)
+
+def is_built():
+    return os.path.exists(os.path.join(feeds_dir(), 'sitemap.xml.etag'))
+
+def ensure_built():
+    # Checked again under the lock so concurrent first requests build once.
+    if is_built():
+        return
+    with _lock:
+        if not is_built():
+            _build_all()
+
+def post_changed(post_id):
+    # Regenerates only the files the post can appear in. Nothing is written
+    # until the first full build, which ensure_built does on first request.
+    if not is_built():
+        return
+    with _lock:
+        old_ids = feed_ids()
+        if old_ids is None or post_id in old_ids:
+            build_feeds()
+        elif any(post[0] == post_id for post in models.feed_posts(FEED_SIZE)):
+            build_feeds()
+        shard = shard_of(post_id)
+        content = build_shard(shard)
+        # The index is one line per shard, so rewriting it is cheap.
+        count = shard_count()
+        build_sitemap_index(count, content if shard == 0 else None)
@@ -0,0 +1,283 @@
+import cProfile
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = format_labels(self.labels, label_values)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append('%s_bucket{%s} %d' % (self.name, join_labels(labels, 'le="%s"' % bound),
+                                                       bucket_count))
+                lines.append('%s_bucket{%s} %d' % (self.name, join_labels(labels, 'le="+Inf"'), count))
+                lines.append('%s_sum{%s} %f' % (self.name, labels, total))
+                lines.append('%s_count{%s} %d' % (self.name, labels, count))
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append('%s{%s} %d' % (self.name, format_labels(self.labels, label_values), value))
+        return lines
+
+
+def format_labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+def join_labels(*parts):
+    return ','.join(part for part in parts if part)
+
+def current_endpoint():
+    return (request.endpoint or 'unknown') if has_request_context() else 'background'
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, instrumentation):
+        self._cursor = cursor
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, args=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, args)
+        finally:
+            self._instrumentation.record_query(self._cursor, sql, args, time.perf_counter() - started)
+
+    def executemany(self, sql, args):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, args)
+        finally:
+            self._instrumentation.record_query(self._cursor, sql, None, time.perf_counter() - started)
+
+
+class Instrumentation:
+    # Opt-in (INSTRUMENTATION = True) timing of requests, SQL statements and
+    # template rendering, exposed at /metrics in Prometheus text format.
+    # Metrics are per process; scrape every worker or run a single one.
+    def __init__(self, app=None, db=None):
+        self.enabled = False
+        self.gauges = []
+        self.request_latency = Histogram('http_request_duration_seconds', 'Request latency by endpoint.',
+                                         ('endpoint', 'method'))
+        self.query_latency = Histogram('sql_query_duration_seconds', 'SQL statement latency by endpoint.',
+                                       ('endpoint', 'statement'))
+        self.template_latency = Histogram('template_render_duration_seconds', 'Jinja render time by template.',
+                                          ('template',))
+        self.query_rows = CounterMetric('sql_rows_total', 'Rows returned or affected by SQL statements.',
+                                        ('endpoint',))
+        self.n_plus_one = CounterMetric('sql_n_plus_one_total', 'Requests repeating one statement too often.',
+                                        ('endpoint', 'statement'))
+        self.full_scans = CounterMetric('sql_full_scan_total', 'Executions of statements EXPLAIN reports as '
+                                        'full table scans.', ('endpoint', 'statement'))
+        self._explained = {}
+        self._explain_lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        if not app.config.get('INSTRUMENTATION'):
+            return
+        self.enabled = True
+        self.n_plus_one_threshold = app.config.get('INSTRUMENTATION_N_PLUS_ONE', 5)
+        self.explain = app.config.get('INSTRUMENTATION_EXPLAIN', True)
+        self.profile_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        self.profile_slow = app.config.get('PROFILE_SLOW_MS', 500) / 1000.0
+        self.profile_dir = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        self.metrics_token = app.config.get('METRICS_TOKEN')
+        self.metrics_allowed_ips = {ip.strip() for ip in app.config.get('METRICS_ALLOWED_IPS', ()) if ip.strip()}
+        db.cursor_wrapper = lambda cursor: InstrumentedCursor(cursor, self)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        if self.metrics_token or self.metrics_allowed_ips:
+            app.add_url_rule('/metrics', 'metrics', self.metrics)
+        else:
+            logger.warning('/metrics is disabled; set METRICS_TOKEN or METRICS_ALLOWED_IPS to expose it')
+
+    def add_gauge(self, name, help, func, kind='gauge'):
+        self.gauges.append((name, help, func, kind))
+
+    # Requests
+
+    def _before_request(self):
+        g._instr_started = time.perf_counter()
+        g._instr_queries = []
+        g._instr_templates = 0.0
+        if self.profile_rate and random.random() < self.profile_rate and self._profile_lock.acquire(False):
+            # Only one profiler can be active per process.
+            g._instr_profiler = cProfile.Profile()
+            g._instr_profiler.enable()
+
+    def _after_request(self, response):
+        if '_instr_started' in g:
+            db_time = sum(duration for _, duration in g._instr_queries)
+            response.headers['Server-Timing'] = 'db;dur=%.1f;desc="%d queries", tpl;dur=%.1f' % (
+                db_time * 1000, len(g._instr_queries), g._instr_templates * 1000)
+        return response
+
+    def _teardown_request(self, exc):
+        started = g.pop('_instr_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = current_endpoint()
+        self.request_latency.observe(elapsed, endpoint, request.method)
+        self._check_n_plus_one(endpoint, g.pop('_instr_queries', []))
+        profiler = g.pop('_instr_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                if elapsed >= self.profile_slow:
+                    self._dump_profile(profiler, endpoint, elapsed)
+            finally:
+                self._profile_lock.release()
+
+    def _dump_profile(self, profiler, endpoint, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, '%s-%d-%dms.prof' % (endpoint, time.time(), elapsed * 1000))
+        profiler.dump_stats(path)
+        logger.warning('Slow request to %s took %.0fms, profile saved to %s', endpoint, elapsed * 1000, path)
+
+    # SQL
+
+    def record_query(self, cursor, sql, args, duration):
+        endpoint = current_endpoint()
+        statement = ' '.join(sql.split())
+        self.query_latency.observe(duration, endpoint, statement[:120])
+        if cursor.rowcount and cursor.rowcount > 0:
+            self.query_rows.inc(endpoint, amount=cursor.rowcount)
+        if has_request_context() and '_instr_queries' in g:
+            g._instr_queries.append((statement, duration))
+        if self.explain and statement[:6].upper() == 'SELECT':
+            if self._is_full_scan(cursor, sql, args, statement):
+                self.full_scans.inc(endpoint, statement[:120])
+
+    def _is_full_scan(self, cursor, sql, args, statement):
+        # Each distinct statement is EXPLAINed once, with the first
+        # arguments it was seen with.
+        full_scan = self._explained.get(statement)
+        if full_scan is not None:
+            return full_scan
+        with self._explain_lock:
+            if statement in self._explained:
+                return self._explained[statement]
+            explain = cursor.connection.cursor()
+            try:
+                explain.execute('EXPLAIN ' + sql, args)
+                columns = [column[0] for column in explain.description]
+                type_index = columns.index('type')
+                full_scan = any(row[type_index] == 'ALL' for row in explain.fetchall())
+            except Exception:
+                full_scan = False
+            finally:
+                explain.close()
+            self._explained[statement] = full_scan
+        if full_scan:
+            logger.warning('Full table scan: %s', statement)
+        return full_scan
+
+    def _check_n_plus_one(self, endpoint, queries):
+        counts = Counter(statement for statement, _ in queries)
+        for statement, count in counts.items():
+            if count >= self.n_plus_one_threshold:
+                self.n_plus_one.inc(endpoint, statement[:120])
+                logger.warning('Possible N+1 in %s: %d executions of %s', endpoint, count, statement)
+
+    # Templates
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_instr_render_stack', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if not has_request_context() or not g.get('_instr_render_stack'):
+            return
+        elapsed = time.perf_counter() - g._instr_render_stack.pop()
+        self.template_latency.observe(elapsed, template.name or 'string')
+        if '_instr_templates' in g:
+            g._instr_templates += elapsed
+
+    # Exposition
+
+    def _metrics_allowed(self):
+        # Scrapers either send the token as a bearer token or connect from
+        # an explicitly allowed address. Behind a proxy every request comes
+        # from the proxy's address, so only list addresses the proxy does
+        # not forward public traffic from.
+        if request.remote_addr in self.metrics_allowed_ips:
+            return True
+        if not self.metrics_token:
+            return False
+        auth = request.headers.get('Authorization', '')
+        return auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].encode(), self.metrics_token.encode())
+
+    def metrics(self):
+        if not self._metrics_allowed():
+            abort(403)
+        lines = []
+        for metric in (self.request_latency, self.query_latency, self.template_latency,
+                       self.query_rows, self.n_plus_one, self.full_scans):
+            lines.extend(metric.expose())
+        for name, help, func, kind in self.gauges:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('%s %s' % (name, func()))
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,256 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    __slots__ = ('id', 'name', 'payload', 'key', 'attempts', 'enqueued_at')
+
+    def __init__(self, name, payload, key=None, job_id=None, attempts=0, enqueued_at=None):
+        self.id = job_id
+        self.name = name
+        self.payload = payload
+        self.key = key
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at or time.time()
+
+
+class JobQueue:
+    # Runs post-write side effects on a small thread pool. With JOBS_PERSISTENT
+    # every job is also a row in the jobs table, so work left over by a
+    # crash or restart is picked up again by the pollers (see `flask jobs-worker`).
+    def __init__(self, app=None, db=None):
+        self.app = None
+        self.db = db
+        self.handlers = {}
+        self._queue = queue.Queue()
+        self._pending_keys = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._scheduled = 0
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        self.workers = app.config.get('JOBS_WORKERS', 2)
+        self.max_attempts = app.config.get('JOBS_MAX_ATTEMPTS', 5)
+        self.backoff = app.config.get('JOBS_BACKOFF', 1.0)
+        self.persistent = app.config.get('JOBS_PERSISTENT', False)
+        self.poll_interval = app.config.get('JOBS_POLL_INTERVAL', 5.0)
+        if self.persistent:
+            # Start the poller with the first request, not the first write,
+            # so a restarted web process picks up orphaned jobs by itself.
+            # CLI commands other than `flask jobs-worker` never start it.
+            app.before_request(self._start)
+
+    def handler(self, name):
+        def decorator(func):
+            self.handlers[name] = func
+            return func
+        return decorator
+
+    def enqueue(self, name, payload=None, key=None):
+        """Queue a job; returns False if a job with the same key has not started yet."""
+        # Must be called inside an app context when JOBS_PERSISTENT is set.
+        payload = payload or {}
+        with self._lock:
+            if key is not None and key in self._pending_keys:
+                return False
+            if key is not None:
+                self._pending_keys.add(key)
+        job = Job(name, payload, key)
+        if self.persistent:
+            try:
+                job.id = self._insert(job)
+            except Exception:
+                self._release_key(job)
+                raise
+            if job.id is None:
+                self._release_key(job)
+                return False
+        self._start()
+        self._queue.put(job)
+        return True
+
+    def stats(self):
+        with self._lock:
+            done = self.processed + self.failed
+            return {
+                'depth': self._queue.qsize() + self._scheduled,
+                'running': self.running,
+                'processed': self.processed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'avg_latency': self.total_latency / done if done else 0.0,
+                'max_latency': self.max_latency,
+            }
+
+    def _start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name='jobs-%d' % i, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self.persistent:
+                thread = threading.Thread(target=self._poll_forever, name='jobs-poller', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self.run(job)
+            except Exception:
+                # Failures to record a job's outcome must not kill the
+                # worker; _start only creates the threads once.
+                logger.exception('Job %s could not be processed', job.name)
+            finally:
+                self._queue.task_done()
+
+    def run(self, job):
+        handler = self.handlers.get(job.name)
+        with self.app.app_context():
+            if job.id is not None and not self._claim(job):
+                return
+            # Once a job has started, a new event for the same key has to run
+            # again, since the handler may already have read the old state.
+            self._release_key(job)
+            with self._lock:
+                self.running += 1
+            try:
+                if handler is None:
+                    raise LookupError('No handler registered for job %r' % job.name)
+                handler(**job.payload)
+            except Exception as e:
+                if job.id is not None:
+                    try:
+                        self.db.connection.rollback()
+                    except Exception:
+                        logger.exception('Rolling back after job %s failed', job.name)
+                self._failed(job, e)
+            else:
+                self._finished(job, 'done')
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+    def _failed(self, job, error):
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            logger.exception('Job %s failed after %d attempts', job.name, job.attempts)
+            self._finished(job, 'failed', error)
+            return
+        delay = self.backoff * 2 ** (job.attempts - 1)
+        logger.warning('Job %s failed (%s), retrying in %.1fs', job.name, error, delay)
+        with self._lock:
+            self.retried += 1
+        if job.id is not None:
+            # The poller picks the row up again once run_at has passed.
+            self._update(job, 'queued', error, delay=delay)
+            return
+        with self._lock:
+            self._scheduled += 1
+        timer = threading.Timer(delay, self._requeue, (job,))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, job):
+        with self._lock:
+            self._scheduled -= 1
+        self._queue.put(job)
+
+    def _finished(self, job, status, error=None):
+        latency = time.time() - job.enqueued_at
+        with self._lock:
+            if status == 'done':
+                self.processed += 1
+            else:
+                self.failed += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        if job.id is not None:
+            self._update(job, status, error)
+
+    def _release_key(self, job):
+        if job.key is not None:
+            with self._lock:
+                self._pending_keys.discard(job.key)
+
+    # Persistence
+
+    def _insert(self, job):
+        db = self.db
+        # The key is cleared when a job is claimed, so INSERT IGNORE only
+        # skips duplicates of jobs that have not started.
+        inserted = db.execute('INSERT IGNORE INTO jobs (name, payload, idempotency_key, run_at) '
+                              'VALUES (%s, %s, %s, NOW())',
+                              (job.name, json.dumps(job.payload), job.key))
+        job_id = db.cursor().lastrowid if inserted else None
+        db.commit()
+        return job_id
+
+    def _claim(self, job):
+        db = self.db
+        claimed = db.execute("UPDATE jobs SET status = 'running', idempotency_key = NULL "
+                             "WHERE id = %s AND status = 'queued'", (job.id,))
+        db.commit()
+        return claimed == 1
+
+    def _update(self, job, status, error=None, delay=None):
+        db = self.db
+        # run_at is computed by MySQL, whose NOW() is what poll() compares
+        # it with.
+        db.execute('UPDATE jobs SET status = %s, attempts = %s, last_error = %s, '
+                   'run_at = COALESCE(NOW() + INTERVAL %s SECOND, run_at) WHERE id = %s',
+                   (status, job.attempts, str(error) if error else None, delay, job.id))
+        db.commit()
+
+    def poll(self, limit=100):
+        """Queue persisted jobs that are due, including ones orphaned by a restart."""
+        db = self.db
+        with self.app.app_context():
+            # Rows stuck in 'running' belonged to a worker that went away.
+            db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' "
+                       'AND updated_at < NOW() - INTERVAL 1 HOUR')
+            db.commit()
+            # Jobs enqueued in-process are already on the queue; give the
+            # workers one poll interval before treating them as orphaned.
+            rows = db.query_all("SELECT id, name, payload, idempotency_key, attempts, "
+                                "UNIX_TIMESTAMP(created_at) FROM jobs WHERE status = 'queued' "
+                                "AND run_at <= NOW() - INTERVAL %s SECOND ORDER BY run_at LIMIT %s",
+                                (int(self.poll_interval), limit))
+        for job_id, name, payload, key, attempts, created_at in rows:
+            self._queue.put(Job(name, json.loads(payload), key, job_id, attempts, float(created_at)))
+        return len(rows)
+
+    def _poll_forever(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling the jobs table failed')
+            time.sleep(self.poll_interval)
+
+    def run_worker(self):
+        """Process persisted jobs in the foreground until interrupted."""
+        self.persistent = True
+        self._start()
+        while True:
+            time.sleep(self.poll_interval)
@@ -1,24 +1,227 @@
-from app import mysql
+from app import db
+from app.render import render_post
+
+POST_CARD_COLUMNS = 'id, title, excerpt, slug, created_at'
 
 def create_tables():
-    cursor = mysql.connection.cursor()
+    cursor = db.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INT AUTO_INCREMENT PRIMARY KEY,
             username VARCHAR(50) NOT NULL UNIQUE,
             email VARCHAR(100) NOT NULL UNIQUE,
-            password VARCHAR(200) NOT NULL
+            password VARCHAR(200) NOT NULL,
+            post_count INT NOT NULL DEFAULT 0
         )
     ''')
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS posts (
             id INT AUTO_INCREMENT PRIMARY KEY,
-            title VARCHAR(200) NOT NULL,
+            title VARCHAR(255) NOT NULL,
             content TEXT NOT NULL,
-            author_id INT,
+            author_id INT NOT NULL,
+            slug VARCHAR(255) UNIQUE NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            excerpt VARCHAR(255) NOT NULL DEFAULT '',
+            content_html MEDIUMTEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_posts_created_at_id (created_at, id),
+            INDEX idx_posts_author_created_at (author_id, created_at),
+            INDEX idx_posts_updated_at (updated_at),
             FOREIGN KEY (author_id) REFERENCES users (id)
         )
     ''')
-    mysql.connection.commit()
-    cursor.close()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            payload TEXT NOT NULL,
+            idempotency_key VARCHAR(191) UNIQUE,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            attempts INT NOT NULL DEFAULT 0,
+            last_error TEXT,
+            run_at DATETIME NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_jobs_status_run_at (status, run_at)
+        )
+    ''')
+    db.commit()
+    migrate()
+
+# Columns and indexes added since the first schema; CREATE TABLE IF NOT
+# EXISTS leaves older databases without them.
+MIGRATIONS = [
+    ('column', 'posts', 'excerpt', "ADD COLUMN excerpt VARCHAR(255) NOT NULL DEFAULT ''"),
+    ('column', 'posts', 'content_html', 'ADD COLUMN content_html MEDIUMTEXT'),
+    ('column', 'users', 'post_count', 'ADD COLUMN post_count INT NOT NULL DEFAULT 0'),
+    ('column', 'posts', 'updated_at',
+     'ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'),
+    ('index', 'posts', 'idx_posts_created_at_id', 'ADD INDEX idx_posts_created_at_id (created_at, id)'),
+    ('index', 'posts', 'idx_posts_author_created_at',
+     'ADD INDEX idx_posts_author_created_at (author_id, created_at)'),
+    ('index', 'posts', 'idx_posts_updated_at', 'ADD INDEX idx_posts_updated_at (updated_at)'),
+]
+
+def migrate():
+    for kind, table, name, alteration in MIGRATIONS:
+        if kind == 'column':
+            exists = db.query_one('SELECT COUNT(*) FROM information_schema.COLUMNS '
+                                  'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s',
+                                  (table, name))[0]
+        else:
+            exists = db.query_one('SELECT COUNT(*) FROM information_schema.STATISTICS '
+                                  'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s',
+                                  (table, name))[0]
+        if exists:
+            continue
+        db.execute('ALTER TABLE %s %s' % (table, alteration))
+        if name == 'excerpt':
+            backfill_excerpts()
+        elif name == 'post_count':
+            recount_posts()
+        elif name == 'updated_at':
+            # Setting the column explicitly keeps ON UPDATE from stamping
+            # every row with the time of the migration.
+            db.execute('UPDATE posts SET updated_at = created_at')
+    db.commit()
+
+def backfill_excerpts(batch_size=500):
+    # Rows written before the excerpt column existed would otherwise show
+    # empty cards on the index page.
+    batch = []
+    for post_id, content, excerpt in iter_posts('id, content, excerpt', batch_size):
+        if excerpt:
+            continue
+        batch.append((render_post(content)[1], post_id))
+        if len(batch) >= batch_size:
+            db.cursor().executemany('UPDATE posts SET excerpt = %s WHERE id = %s', batch)
+            db.commit()
+            batch = []
+    if batch:
+        db.cursor().executemany('UPDATE posts SET excerpt = %s WHERE id = %s', batch)
+    db.commit()
+
+def recount_posts():
+    db.execute('UPDATE users SET post_count = '
+               '(SELECT COUNT(*) FROM posts WHERE posts.author_id = users.id)')
+    db.commit()
+
+# Users
+
+def get_user(user_id):
+    return db.query_one('SELECT * FROM users WHERE id = %s', (user_id,))
+
+def get_user_by_email(email):
+    return db.query_one('SELECT * FROM users WHERE email = %s', (email,))
+
+def get_author(username):
+    return db.query_one('SELECT id, username, post_count FROM users WHERE username = %s', (username,))
+
+def create_user(username, email, password):
+    db.execute('INSERT INTO users (username, email, password) VALUES (%s, %s, %s)',
+               (username, email, password))
+    db.commit()
+
+# Posts
+
+def get_post(slug):
+    return db.query_one('SELECT * FROM posts WHERE slug = %s', (slug,))
+
+def get_post_by_id(post_id):
+    return db.query_one('SELECT * FROM posts WHERE id = %s', (post_id,))
+
+def get_author_post(slug, author_id):
+    return db.query_one('SELECT * FROM posts WHERE slug = %s AND author_id = %s', (slug, author_id))
+
+def author_posts_page(author_id, page_size, after=None):
+    # Same keyset as feed_page, seeking on idx_posts_author_created_at.
+    if after:
+        created_at, post_id = after
+        return db.query_all('SELECT ' + POST_CARD_COLUMNS + ' FROM posts WHERE author_id = %s '
+                            'AND (created_at < %s OR (created_at = %s AND id < %s)) '
+                            'ORDER BY created_at DESC, id DESC LIMIT %s',
+                            (author_id, created_at, created_at, post_id, page_size))
+    return db.query_all('SELECT ' + POST_CARD_COLUMNS + ' FROM posts WHERE author_id = %s '
+                        'ORDER BY created_at DESC, id DESC LIMIT %s', (author_id, page_size))
+
+def feed_page(page_size, after=None):
+    # Keyset pagination on (created_at, id), served by idx_posts_created_at_id.
+    if after:
+        created_at, post_id = after
+        return db.query_all('SELECT ' + POST_CARD_COLUMNS + ' FROM posts '
+                            'WHERE created_at < %s OR (created_at = %s AND id < %s) '
+                            'ORDER BY created_at DESC, id DESC LIMIT %s',
+                            (created_at, created_at, post_id, page_size))
+    return db.query_all('SELECT ' + POST_CARD_COLUMNS + ' FROM posts '
+                        'ORDER BY created_at DESC, id DESC LIMIT %s', (page_size,))
+
+def feed_posts(limit):
+    # Newest posts for the RSS/Atom feeds, with updated_at for <updated>.
+    return db.query_all('SELECT ' + POST_CARD_COLUMNS + ', updated_at FROM posts '
+                        'ORDER BY created_at DESC, id DESC LIMIT %s', (limit,))
+
+def create_post(title, content, content_html, excerpt, slug, author_id):
+    db.execute('INSERT INTO posts (title, content, content_html, excerpt, slug, author_id) '
+               'VALUES (%s, %s, %s, %s, %s, %s)',
+               (title, content, content_html, excerpt, slug, author_id))
+    post_id = db.cursor().lastrowid
+    db.execute('UPDATE users SET post_count = post_count + 1 WHERE id = %s', (author_id,))
+    db.commit()
+    return post_id
+
+def update_post(post_id, title, content, content_html, excerpt, slug):
+    db.execute('UPDATE posts SET title = %s, content = %s, content_html = %s, excerpt = %s, slug = %s '
+               'WHERE id = %s',
+               (title, content, content_html, excerpt, slug, post_id))
+    db.commit()
+
+def delete_post(slug, author_id):
+    deleted = db.execute('DELETE FROM posts WHERE slug = %s AND author_id = %s', (slug, author_id))
+    if deleted:
+        db.execute('UPDATE users SET post_count = post_count - %s WHERE id = %s', (deleted, author_id))
+    db.commit()
+    return deleted
+
+def get_posts_by_ids(post_ids):
+    if not post_ids:
+        return ()
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    return db.query_all('SELECT id, title, slug, content, created_at FROM posts WHERE id IN (%s)' % placeholders,
+                        tuple(post_ids))
+
+def posts_in_id_range(first_id, last_id):
+    return db.query_all('SELECT slug, created_at, updated_at FROM posts WHERE id BETWEEN %s AND %s ORDER BY id',
+                        (first_id, last_id))
+
+def max_post_id():
+    return db.query_one('SELECT MAX(id) FROM posts')[0]
+
+def db_now():
+    # The database clock, comparable with created_at and updated_at.
+    return db.query_one('SELECT NOW()')[0]
+
+def iter_posts(columns='id, title, content', batch_size=1000, updated_since=None):
+    # Walks the table in primary key order without holding it all in memory.
+    last_id = 0
+    while True:
+        if updated_since is None:
+            rows = db.query_all('SELECT ' + columns + ' FROM posts WHERE id > %s ORDER BY id LIMIT %s',
+                                (last_id, batch_size))
+        else:
+            rows = db.query_all('SELECT ' + columns + ' FROM posts WHERE id > %s AND updated_at >= %s '
+                                'ORDER BY id LIMIT %s', (last_id, updated_since, batch_size))
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+def update_rendered(rows):
+    # rows are (content_html, excerpt, id) tuples
+    db.cursor().executemany('UPDATE posts SET content_html = %s, excerpt = %s WHERE id = %s', rows)
+    db.commit()
+
+def add_post_counts(counts):
+    # counts maps author_id to the number of posts just inserted
+    db.cursor().executemany('UPDATE users SET post_count = post_count + %s WHERE id = %s',
+                            [(count, author_id) for author_id, count in counts.items()])
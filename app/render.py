@@ -0,0 +1,58 @@
+import html
+
+import bleach
+import markdown
+
+EXCERPT_LENGTH = 200
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'codehilite', 'tables', 'sane_lists']
+MARKDOWN_EXTENSION_CONFIGS = {
+    'codehilite': {'css_class': 'codehilite', 'guess_lang': False},
+    # align="..." survives sanitizing; the default style="text-align: ..." does not.
+    'tables': {'use_align_attribute': True},
+}
+
+ALLOWED_TAGS = set(bleach.sanitizer.ALLOWED_TAGS) | {
+    'p', 'br', 'hr', 'pre', 'span', 'div', 'img',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'abbr': ['title'],
+    'acronym': ['title'],
+    'img': ['src', 'alt', 'title'],
+    'code': ['class'],
+    'div': ['class'],
+    'pre': ['class'],
+    'span': ['class'],
+    'th': ['align'],
+    'td': ['align'],
+}
+ALLOWED_PROTOCOLS = ['http', 'https', 'mailto']
+
+
+def render_markdown(text):
+    # Authors may embed raw HTML in Markdown, so the output is sanitized
+    # before it is stored and later printed with |safe.
+    rendered = markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS,
+                                 extension_configs=MARKDOWN_EXTENSION_CONFIGS)
+    return bleach.clean(rendered, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES,
+                        protocols=ALLOWED_PROTOCOLS, strip=True)
+
+
+def html_to_text(markup):
+    return html.unescape(bleach.clean(markup, tags=set(), strip=True))
+
+
+def make_excerpt(content):
+    excerpt = ' '.join(content.split())
+    if len(excerpt) <= EXCERPT_LENGTH:
+        return excerpt
+    return excerpt[:EXCERPT_LENGTH].rsplit(' ', 1)[0] + '...'
+
+
+def render_post(content):
+    """Return the stored (content_html, excerpt) pair for a post's Markdown."""
+    content_html = render_markdown(content)
+    return content_html, make_excerpt(html_to_text(content_html))
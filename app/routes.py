@@ -1,21 +1,34 @@
-from flask import render_template, url_for, flash, redirect, request
-from app import app, mysql
+from flask import render_template, url_for, flash, redirect, request, jsonify, abort, send_file
+from app import app, feeds, jobs, models, page_cache, search_index
+from app.cache import cache_tag, TTLCache
+from app.commands import ensure_search_index
+from app.render import render_post
+from app.search import highlight
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired, Email, EqualTo
 from flask_login import LoginManager, UserMixin, login_user, current_user, logout_user, login_required
+import os
 import re
+from datetime import datetime
 # from pythoncms import CMS, admin_required
 
 login_manager = LoginManager(app)
+user_cache = TTLCache(ttl=app.config.get('USER_CACHE_TTL', 30),
+                      max_entries=app.config.get('USER_CACHE_SIZE', 1024))
 
 @login_manager.user_loader
 def load_user(user_id):
-    cursor = mysql.connection.cursor()
-    cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-    user = cursor.fetchone()
-    cursor.close()
-    return User(user) if user else None
+    # Called on every authenticated request, so keep recently seen users
+    # for a short while instead of querying the users table each time.
+    user = user_cache.get(user_id)
+    if user is None:
+        row = models.get_user(user_id)
+        if not row:
+            return None
+        user = User(row)
+        user_cache.set(user_id, user)
+    return user
 
 class User(UserMixin):
     def __init__(self, user):
@@ -41,35 +54,194 @@ class PostForm(FlaskForm):
     content = TextAreaField('Content', validators=[DataRequired()])
     submit = SubmitField('Post')
 
+FEED_PAGE_SIZE = 10
+AUTHOR_PAGE_SIZE = 20
+CURSOR_FORMAT = '%Y%m%d%H%M%S'
+
 def generate_slug(title):
     slug = re.sub(r'[^\w\s-]', '', title).strip().lower()
     slug = re.sub(r'[-\s]+', '-', slug)
     return slug
 
+def encode_cursor(post):
+    # post is (id, title, excerpt, slug, created_at)
+    return '%s-%d' % (post[4].strftime(CURSOR_FORMAT), post[0])
+
+def decode_cursor(cursor):
+    try:
+        created_at, post_id = cursor.split('-', 1)
+        return datetime.strptime(created_at, CURSOR_FORMAT), int(post_id)
+    except ValueError:
+        abort(400)
+
+def fetch_page(query, cursor_token, page_size):
+    # One extra row is fetched to know whether there is a next page.
+    after = decode_cursor(cursor_token) if cursor_token else None
+    posts = query(page_size + 1, after)
+    next_cursor = encode_cursor(posts[page_size - 1]) if len(posts) > page_size else None
+    return posts[:page_size], next_cursor
+
+def fetch_feed_page(cursor_token=None, page_size=FEED_PAGE_SIZE):
+    return fetch_page(models.feed_page, cursor_token, page_size)
+
+def fetch_author_page(author_id, cursor_token=None, page_size=AUTHOR_PAGE_SIZE):
+    return fetch_page(lambda limit, after: models.author_posts_page(author_id, limit, after),
+                      cursor_token, page_size)
+
+def enqueue_post_saved(post_id):
+    # Page cache invalidation stays inline: it is cheap and must be visible
+    # before the redirect. Everything slower runs from the job queue
+    # (app/tasks.py).
+    jobs.enqueue('post.saved', {'post_id': post_id}, key='post.saved:%d' % post_id)
+
+def feed_cache_key():
+    return 'index:%s' % request.args.get('cursor', '')
+
+def invalidate_post_pages(*slugs, new=False, author_id=None):
+    # Feed pages are keyed by cursor, so a new post only changes the head
+    # page; edits and deletes evict exactly the pages that list the post.
+    # Author pages all show the post count, so they go when it changes.
+    tags = ['post:%s' % slug for slug in slugs]
+    if new:
+        tags.append('feed:head')
+    if author_id is not None:
+        tags.append('author:%s' % author_id)
+    page_cache.invalidate(keys=['post:%s' % slug for slug in slugs], tags=tags)
+
 @app.route('/')
+@page_cache.cached(feed_cache_key)
 def index():
-    cursor = mysql.connection.cursor()
-    cursor.execute('SELECT * FROM posts ORDER BY created_at DESC')
-    posts = cursor.fetchall()
-    cursor.close()
-    return render_template('index.html', posts=posts)
+    posts, next_cursor = fetch_feed_page(request.args.get('cursor'))
+    cache_tag(*['post:%s' % p[3] for p in posts])
+    if not request.args.get('cursor'):
+        cache_tag('feed:head')
+    return render_template('index.html', posts=posts, next_cursor=next_cursor)
+
+@app.route('/author/<username>')
+@page_cache.cached(lambda username: 'author:%s:%s' % (username, request.args.get('cursor', '')))
+def author(username):
+    author = models.get_author(username)
+    if not author:
+        abort(404)
+    posts, next_cursor = fetch_author_page(author[0], request.args.get('cursor'))
+    cache_tag('author:%s' % author[0], *['post:%s' % p[3] for p in posts])
+    return render_template('author.html', author=author, posts=posts, next_cursor=next_cursor)
+
+@app.route('/api/posts')
+def api_posts():
+    page_size = min(request.args.get('limit', FEED_PAGE_SIZE, type=int), 100)
+    posts, next_cursor = fetch_feed_page(request.args.get('cursor'), max(page_size, 1))
+    return jsonify({
+        'posts': [{'id': p[0], 'title': p[1], 'excerpt': p[2], 'slug': p[3],
+                   'created_at': p[4].isoformat(),
+                   'url': url_for('post', slug=p[3], _external=True)} for p in posts],
+        'next_cursor': next_cursor,
+    })
 
 @app.route('/post/<slug>')
+@page_cache.cached(lambda slug: 'post:%s' % slug)
 def post(slug):
-    cursor = mysql.connection.cursor()
-    cursor.execute('SELECT * FROM posts WHERE slug = %s', (slug,))
-    post = cursor.fetchone()
-    cursor.close()
+    post = models.get_post(slug)
+    if not post:
+        abort(404)
+    cache_tag('post:%s' % slug)
     return render_template('post.html', post=post)
 
+SEARCH_PAGE_SIZE = 10
+
+def run_search(query):
+    # Returns None while the index is still loading.
+    if not ensure_search_index():
+        return None
+    ranked, terms = search_index.search(query, SEARCH_PAGE_SIZE)
+    rows = {row[0]: row for row in models.get_posts_by_ids([doc_id for doc_id, _ in ranked])}
+    results = []
+    for doc_id, score in ranked:
+        row = rows.get(doc_id)
+        if row:
+            results.append({'id': row[0], 'title': row[1], 'slug': row[2], 'score': score,
+                            'snippet': highlight(row[3], terms), 'created_at': row[4]})
+        else:
+            # Deleted while the index was not listening.
+            search_index.remove(doc_id)
+    return results
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    results = run_search(query) if query else []
+    return render_template('search.html', query=query, results=results)
+
+@app.route('/api/search')
+def api_search():
+    query = request.args.get('q', '').strip()
+    results = run_search(query) if query else []
+    if results is None:
+        response = jsonify({'query': query, 'results': [], 'error': 'search index is loading'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return jsonify({
+        'query': query,
+        'results': [{'id': r['id'], 'title': r['title'], 'slug': r['slug'],
+                     'score': round(r['score'], 4), 'snippet': str(r['snippet']),
+                     'created_at': r['created_at'].isoformat(),
+                     'url': url_for('post', slug=r['slug'], _external=True)} for r in results],
+    })
+
+def send_feed_file(name, mimetype):
+    # Feeds and sitemaps are pre-generated by app/feeds.py, so serving one
+    # is a file read; clients get the gzip or brotli variant when accepted.
+    feeds.ensure_built()
+    path = os.path.join(feeds.feeds_dir(), name)
+    if not os.path.exists(path):
+        abort(404)
+    with open(path + '.etag', encoding='ascii') as f:
+        etag = f.read()
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.exists(path + suffix):
+            encoding = candidate
+            path += suffix
+            etag += suffix.replace('.', '-')
+            break
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=300)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/feed.xml')
+def rss_feed():
+    return send_feed_file('feed.xml', 'application/rss+xml')
+
+@app.route('/atom.xml')
+def atom_feed():
+    return send_feed_file('atom.xml', 'application/atom+xml')
+
+@app.route('/sitemap.xml')
+def sitemap():
+    return send_feed_file('sitemap.xml', 'application/xml')
+
+@app.route('/sitemap-<int:shard>.xml')
+def sitemap_shard(shard):
+    return send_feed_file('sitemap-%d.xml' % shard, 'application/xml')
+
+@app.route('/cache_stats')
+@login_required
+def cache_stats():
+    return jsonify(page_cache.stats())
+
+@app.route('/jobs_stats')
+@login_required
+def jobs_stats():
+    return jsonify(jobs.stats())
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        cursor = mysql.connection.cursor()
-        cursor.execute('SELECT * FROM users WHERE email = %s', (form.email.data,))
-        user = cursor.fetchone()
-        cursor.close()
+        user = models.get_user_by_email(form.email.data)
         if user and user[3] == form.password.data:  # Note: Use hashed passwords in production
             user_obj = User(user)
             login_user(user_obj)
@@ -82,11 +254,7 @@ def login():
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():
-        cursor = mysql.connection.cursor()
-        cursor.execute('INSERT INTO users (username, email, password) VALUES (%s, %s, %s)',
-                       (form.username.data, form.email.data, form.password.data))
-        mysql.connection.commit()
-        cursor.close()
+        models.create_user(form.username.data, form.email.data, form.password.data)
         flash('Account created successfully', 'success')
         return redirect(url_for('login'))
     return render_template('register.html', form=form)
@@ -94,7 +262,8 @@ def register():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    return render_template('dashboard.html')
+    posts, next_cursor = fetch_author_page(current_user.id, request.args.get('cursor'))
+    return render_template('dashboard.html', posts=posts, next_cursor=next_cursor)
 
 @app.route('/new_post', methods=['GET', 'POST'])
 @login_required
@@ -102,11 +271,11 @@ def new_post():
     form = PostForm()
     if form.validate_on_submit():
         slug = generate_slug(form.title.data)
-        cursor = mysql.connection.cursor()
-        cursor.execute('INSERT INTO posts (title, content, slug, author_id) VALUES (%s, %s, %s, %s)',
-                       (form.title.data, form.content.data, slug, current_user.id))
-        mysql.connection.commit()
-        cursor.close()
+        content_html, excerpt = render_post(form.content.data)
+        post_id = models.create_post(form.title.data, form.content.data, content_html, excerpt,
+                                     slug, current_user.id)
+        invalidate_post_pages(slug, new=True, author_id=current_user.id)
+        enqueue_post_saved(post_id)
         flash('Post created successfully', 'success')
         return redirect(url_for('index'))
     return render_template('new_post.html', form=form)
@@ -114,10 +283,7 @@ def new_post():
 @app.route('/edit_post/<slug>', methods=['GET', 'POST'])
 @login_required
 def edit_post(slug):
-    cursor = mysql.connection.cursor()
-    cursor.execute('SELECT * FROM posts WHERE slug = %s AND author_id = %s', (slug, current_user.id))
-    post = cursor.fetchone()
-    cursor.close()
+    post = models.get_author_post(slug, current_user.id)
 
     if not post:
         flash('Post not found or you do not have permission to edit it.', 'danger')
@@ -126,11 +292,10 @@ def edit_post(slug):
     form = PostForm(data={'title': post[1], 'content': post[2]})
     if form.validate_on_submit():
         new_slug = generate_slug(form.title.data)
-        cursor = mysql.connection.cursor()
-        cursor.execute('UPDATE posts SET title = %s, content = %s, slug = %s WHERE id = %s',
-                       (form.title.data, form.content.data, new_slug, post[0]))
-        mysql.connection.commit()
-        cursor.close()
+        content_html, excerpt = render_post(form.content.data)
+        models.update_post(post[0], form.title.data, form.content.data, content_html, excerpt, new_slug)
+        invalidate_post_pages(slug, new_slug)
+        enqueue_post_saved(post[0])
         flash('Post updated successfully', 'success')
         return redirect(url_for('index'))
 
@@ -139,10 +304,13 @@ def edit_post(slug):
 @app.route('/delete_post/<slug>')
 @login_required
 def delete_post(slug):
-    cursor = mysql.connection.cursor()
-    cursor.execute('DELETE FROM posts WHERE slug = %s AND author_id = %s', (slug, current_user.id))
-    mysql.connection.commit()
-    cursor.close()
+    post = models.get_author_post(slug, current_user.id)
+    if not post:
+        flash('Post not found or you do not have permission to delete it.', 'danger')
+        return redirect(url_for('index'))
+    models.delete_post(slug, current_user.id)
+    invalidate_post_pages(slug, author_id=current_user.id)
+    jobs.enqueue('post.deleted', {'post_id': post[0]}, key='post.deleted:%d' % post[0])
     flash('Post deleted successfully', 'success')
     return redirect(url_for('index'))
 
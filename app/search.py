@@ -0,0 +1,283 @@
+import bisect
+import heapq
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+from collections import Counter
+
+from markupsafe import Markup, escape
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+TITLE_WEIGHT = 3
+MAX_PREFIX_EXPANSIONS = 50
+MIN_PREFIX_LENGTH = 3
+SNAPSHOT_VERSION = 2
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its not of on or so such
+that the their then there these they this to was we were will with you your
+""".split())
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text)]
+
+def index_terms(text):
+    return [token for token in tokenize(text) if token not in STOP_WORDS]
+
+
+class SearchIndex:
+    # Incremental inverted index with BM25 ranking. Only postings and
+    # document lengths are kept in memory; result rows come from MySQL.
+    #
+    # Postings hold each document's BM25 term weight quantized to 1..255,
+    # and every term keeps its documents ordered by that impact, so a query
+    # walks the lists from the top and stops as soon as no unseen document
+    # can reach the top `limit` (Fagin's threshold algorithm). Queries made
+    # only of very common words stop after max_scored documents and return
+    # the best found so far. The average document length used for impacts
+    # is fixed when the index is built; `flask reindex` refreshes it.
+    k1 = 1.2
+    b = 0.75
+    levels = 255
+    block_size = 64
+    max_scored = 4000
+
+    def __init__(self):
+        self._postings = {}
+        self._ranked = {}
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._avg_length = None
+        self._vocabulary = []
+        self._pending = set()
+        self._lock = threading.RLock()
+        self.indexed_at = None
+        self.loading = False
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def _impact(self, tf, length):
+        # tf / (tf + norm) is below 1, so the k1 + 1 factor is left to
+        # search() and the result fits the quantization range.
+        norm = self.k1 * (1 - self.b + self.b * length / self._avg_length)
+        return max(1, round(self.levels * tf / (tf + norm)))
+
+    def _rank_key(self, term):
+        postings = self._postings[term]
+        return lambda doc_id: (-postings[doc_id], doc_id)
+
+    def add(self, doc_id, title, content):
+        # Until finish_build() runs, postings hold raw term frequencies and
+        # documents are appended unordered, so a full build does not pay
+        # for an insort per posting.
+        tokens = index_terms(title) * TITLE_WEIGHT + index_terms(content)
+        counts = Counter(tokens)
+        with self._lock:
+            self._remove(doc_id)
+            self._doc_terms[doc_id] = tuple(counts)
+            self._doc_lengths[doc_id] = len(tokens)
+            self._total_length += len(tokens)
+            for term, tf in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._ranked[term] = []
+                    bisect.insort(self._vocabulary, term)
+                if self._avg_length is None:
+                    postings[doc_id] = tf
+                    self._ranked[term].append(doc_id)
+                else:
+                    postings[doc_id] = self._impact(tf, len(tokens))
+                    bisect.insort(self._ranked[term], doc_id, key=self._rank_key(term))
+
+    def finish_build(self, indexed_at=None):
+        with self._lock:
+            if self._avg_length is None:
+                self._avg_length = max(self._total_length / len(self._doc_lengths), 1.0) if self._doc_lengths else 1.0
+                lengths = self._doc_lengths
+                for term, postings in self._postings.items():
+                    for doc_id, tf in postings.items():
+                        postings[doc_id] = self._impact(tf, lengths[doc_id])
+                    self._ranked[term].sort(key=self._rank_key(term))
+            self.indexed_at = indexed_at
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            ranked = self._ranked[term]
+            if self._avg_length is None:
+                ranked.remove(doc_id)
+            else:
+                key = self._rank_key(term)
+                del ranked[bisect.bisect_left(ranked, key(doc_id), key=key)]
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                del self._ranked[term]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def start_loading(self):
+        with self._lock:
+            self.loading = True
+
+    def defer(self, doc_id):
+        # Returns False once the index is loaded and the caller should apply
+        # the change itself. Writes during loading are kept for
+        # finish_loading(); before that there is nothing to update, and the
+        # catch-up after loading picks them up from the database.
+        with self._lock:
+            if self.loaded:
+                return False
+            if self.loading:
+                self._pending.add(doc_id)
+            return True
+
+    def finish_loading(self):
+        # Returns the writes deferred so far; when there are none left the
+        # index is marked loaded under the same lock, so none are lost.
+        with self._lock:
+            pending = self._pending
+            self._pending = set()
+            if not pending:
+                self.loading = False
+                self.loaded = True
+            return pending
+
+    def expand(self, prefix):
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def parse_query(self, query):
+        # The last word (and any word ending in '*') is matched as a prefix
+        # so results show up while the user is still typing. Stop words and
+        # prefixes shorter than MIN_PREFIX_LENGTH only match exactly.
+        words = query.split()
+        terms = []
+        for i, word in enumerate(words):
+            explicit = word.endswith('*')
+            for token in tokenize(word):
+                if token in STOP_WORDS and not explicit:
+                    continue
+                is_prefix = (explicit or i == len(words) - 1) and len(token) >= MIN_PREFIX_LENGTH
+                terms.append((token, is_prefix))
+        return terms
+
+    def search(self, query, limit=10):
+        with self._lock:
+            doc_count = len(self._doc_lengths)
+            if not doc_count or self._avg_length is None:
+                return [], []
+            matched = []
+            for token, is_prefix in self.parse_query(query):
+                terms = self.expand(token) if is_prefix else []
+                if token in self._postings and token not in terms:
+                    terms.append(token)
+                matched.extend(term for term in terms if term not in matched)
+            lists = []
+            for term in matched:
+                postings = self._postings[term]
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                lists.append((self._ranked[term], postings, idf))
+            top = []
+            seen = set()
+            depth = 0
+            longest = max((len(ranked) for ranked, _, _ in lists), default=0)
+            while depth < longest and len(seen) < self.max_scored:
+                end = depth + self.block_size
+                # No document below this block can score more than the sum
+                # of the lowest impacts in it.
+                threshold = 0.0
+                for ranked, postings, idf in lists:
+                    block = ranked[depth:end]
+                    if not block:
+                        continue
+                    threshold += idf * postings[block[-1]]
+                    new = [doc_id for doc_id in block if doc_id not in seen]
+                    if not new:
+                        continue
+                    seen.update(new)
+                    scores = [0.0] * len(new)
+                    for _, other, other_idf in lists:
+                        get = other.get
+                        scores = [score + other_idf * get(doc_id, 0) for score, doc_id in zip(scores, new)]
+                    for score, doc_id in zip(scores, new):
+                        if len(top) < limit:
+                            heapq.heappush(top, (score, doc_id))
+                        elif score > top[0][0]:
+                            heapq.heapreplace(top, (score, doc_id))
+                depth = end
+                if len(top) >= limit and top[0][0] >= threshold:
+                    break
+        scale = (self.k1 + 1) / self.levels
+        ranked = [(doc_id, score * scale) for score, doc_id in sorted(top, reverse=True)]
+        return ranked, matched
+
+    def clear(self):
+        with self._lock:
+            pending, loading = self._pending, self.loading
+            self.__init__()
+            self._pending, self.loading = pending, loading
+
+    def save(self, path):
+        with self._lock:
+            state = (SNAPSHOT_VERSION, self._postings, self._ranked, self._doc_terms, self._doc_lengths,
+                     self._total_length, self._avg_length, self._vocabulary, self.indexed_at)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        # Raises ValueError for snapshots written by an older version.
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if not isinstance(state, tuple) or state[0] != SNAPSHOT_VERSION:
+            raise ValueError('Search index snapshot %s is from an older version' % path)
+        with self._lock:
+            (_, self._postings, self._ranked, self._doc_terms, self._doc_lengths,
+             self._total_length, self._avg_length, self._vocabulary, self.indexed_at) = state
+
+
+def highlight(text, terms, width=200):
+    # Returns an escaped excerpt of text around the first matched term,
+    # with every matched term wrapped in <mark>.
+    if not terms:
+        return escape(text[:width])
+    pattern = re.compile(r'\b(%s)\w*' % '|'.join(re.escape(t) for t in sorted(terms, key=len, reverse=True)),
+                         re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, match.start() - width // 4) if match else 0
+    window = text[start:start + width]
+    parts = []
+    last = 0
+    for m in pattern.finditer(window):
+        parts.append(escape(window[last:m.start()]))
+        parts.append(Markup('<mark>%s</mark>') % m.group(0))
+        last = m.end()
+    parts.append(escape(window[last:]))
+    snippet = Markup('').join(parts)
+    if start > 0:
+        snippet = Markup('&hellip;') + snippet
+    if start + width < len(text):
+        snippet += Markup('&hellip;')
+    return snippet
@@ -0,0 +1,15 @@
+from app import feeds, jobs
+from app.commands import refresh_search_post
+
+# Handlers reload the post instead of trusting the payload, so a job that
+# runs late or twice still leaves everything matching the database.
+
+@jobs.handler('post.saved')
+def post_saved(post_id):
+    refresh_search_post(post_id)
+    feeds.post_changed(post_id)
+
+@jobs.handler('post.deleted')
+def post_deleted(post_id):
+    refresh_search_post(post_id)
+    feeds.post_changed(post_id)
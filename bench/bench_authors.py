@@ -0,0 +1,61 @@
+"""Author page latency with many authors and one very prolific one.
+
+Seeds --authors users and --posts posts. One author writes about a tenth
+of the posts, and the rest are spread evenly. It then recounts post_count
+and times the author lookup, head pages for random authors and for the
+prolific one, and pages reached by cursor deep into the prolific author's
+posts. With idx_posts_author_created_at and the stored post_count all of
+these should stay flat however many posts an author has:
+
+    python bench/bench_authors.py --authors 10000 --posts 1000000
+
+It seeds its own database by default, because seed_posts keeps whatever
+posts are already there and the other benchmarks spread theirs over only
+a few authors.
+"""
+import argparse
+import random
+import sys
+
+from common import bench_app, report, seed_posts, seed_users, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='tech_blog_bench_authors')
+    parser.add_argument('--authors', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    app = bench_app(args.database)
+    from app import db, models
+    from app.routes import CURSOR_FORMAT, fetch_author_page
+
+    with app.app_context():
+        models.create_tables()
+        author_ids = seed_users(db, args.authors)
+        prolific = author_ids[0]
+        seed_posts(db, args.posts, author_ids + [prolific] * (len(author_ids) // 9))
+        models.recount_posts()
+        spread = db.query_one('SELECT COUNT(DISTINCT author_id) FROM posts')[0]
+        if spread < min(args.authors, args.posts) // 2:
+            sys.exit('%s has posts by only %d authors; seed a fresh --database' % (args.database, spread))
+
+        rng = random.Random(42)
+        usernames = ['bench-user-%d' % i for i in range(len(author_ids))]
+        print('Prolific author has %d posts' % models.get_author(usernames[0])[2])
+
+        report('get_author', time_calls(lambda: models.get_author(rng.choice(usernames)), args.repeat))
+        report('head page, random author',
+               time_calls(lambda: fetch_author_page(rng.choice(author_ids)), args.repeat))
+        report('head page, prolific author', time_calls(lambda: fetch_author_page(prolific), args.repeat))
+
+        rows = db.query_all('SELECT id, created_at FROM posts WHERE author_id = %s ORDER BY RAND() LIMIT 500',
+                            (prolific,))
+        cursors = ['%s-%d' % (created_at.strftime(CURSOR_FORMAT), post_id) for post_id, created_at in rows]
+        report('cursor page, prolific author',
+               time_calls(lambda: fetch_author_page(prolific, rng.choice(cursors)), args.repeat))
+
+if __name__ == '__main__':
+    main()
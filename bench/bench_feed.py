@@ -0,0 +1,45 @@
+"""Index feed latency as the posts table grows.
+
+Seeds tech_blog_bench up to each size and times the head page plus pages
+reached by following cursors deep into the feed. With keyset pagination
+on idx_posts_created_at_id the p50/p99 should stay flat from 1k to 1M:
+
+    python bench/bench_feed.py --sizes 1000,10000,100000,1000000
+"""
+import argparse
+import random
+
+from common import bench_app, report, seed_posts, seed_users, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='tech_blog_bench')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    app = bench_app(args.database)
+    from app import db, models
+    from app.routes import CURSOR_FORMAT, fetch_feed_page
+
+    with app.app_context():
+        models.create_tables()
+        author_ids = seed_users(db, 10)
+        for size in [int(s) for s in args.sizes.split(',')]:
+            seed_posts(db, size, author_ids)
+            report('%d posts, head page' % size, time_calls(fetch_feed_page, args.repeat))
+
+            # Cursors taken from random posts anywhere in the table, so deep
+            # pages are measured as well as recent ones.
+            rng = random.Random(size)
+            cursors = []
+            for post_id in rng.sample(range(1, size + 1), min(size, 500)):
+                row = db.query_one('SELECT id, created_at FROM posts WHERE id = %s', (post_id,))
+                if row:
+                    cursors.append('%s-%d' % (row[1].strftime(CURSOR_FORMAT), row[0]))
+            report('%d posts, random cursor page' % size,
+                   time_calls(lambda: fetch_feed_page(rng.choice(cursors)), args.repeat))
+
+if __name__ == '__main__':
+    main()
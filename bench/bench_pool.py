@@ -0,0 +1,91 @@
+"""Request throughput with the connection pool against connect-per-request.
+
+Runs concurrent threads, each with its own test client, against /post/<slug>
+and /api/posts, and reports req/s and latency percentiles. First it uses the
+pool, then a pool that opens a fresh connection for every request and
+closes it afterwards, which is how the app worked before the pool:
+
+    python bench/bench_pool.py --threads 1,8,32 --requests 2000
+"""
+import argparse
+import random
+import threading
+import time
+
+from common import bench_app, percentile, seed_posts, seed_users
+
+
+def make_per_request_pool(pool):
+    from app.db import _PooledConnection
+
+    class PerRequestPool:
+        in_use = 0
+
+        def acquire(self):
+            return _PooledConnection(pool._connect())
+
+        def release(self, pooled, discard=False):
+            pooled.conn.close()
+
+        def idle(self):
+            return 0
+
+    return PerRequestPool()
+
+
+def load(app, paths, threads, total):
+    samples = []
+    lock = threading.Lock()
+
+    def worker(count, seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        mine = []
+        for _ in range(count):
+            started = time.perf_counter()
+            response = client.get(rng.choice(paths))
+            mine.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+        with lock:
+            samples.extend(mine)
+
+    workers = [threading.Thread(target=worker, args=(total // threads, n)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='tech_blog_bench')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--threads', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = bench_app(args.database)
+    from app import db, models
+
+    with app.app_context():
+        models.create_tables()
+        seed_posts(db, args.posts, seed_users(db, 10))
+        slugs = [row[0] for row in db.query_all('SELECT slug FROM posts ORDER BY RAND() LIMIT 500')]
+    paths = ['/post/%s' % slug for slug in slugs] + ['/api/posts']
+
+    pool = db.pool
+    for threads in [int(t) for t in args.threads.split(',')]:
+        for label, candidate in (('pooled', pool), ('per-request', make_per_request_pool(pool))):
+            db.pool = candidate
+            load(app, paths, threads, min(threads * 10, args.requests))  # warm up
+            samples, elapsed = load(app, paths, threads, args.requests)
+            print('%-12s threads=%-3d %8.0f req/s  p50=%7.2fms  p99=%7.2fms' % (
+                label, threads, len(samples) / elapsed,
+                percentile(samples, 50) * 1000, percentile(samples, 99) * 1000))
+    db.pool = pool
+    pool.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Markdown rendered on every read against HTML rendered once on write.
+
+Generates long technical posts (headings, prose, fenced code, tables and
+lists) and times serving one both ways: running render_markdown and the
+template for every view, as a read-time renderer would, or only the
+template around the content_html stored when the post was saved:
+
+    python bench/bench_render.py --sections 5,20,80
+"""
+import argparse
+import random
+
+from jinja2 import Template
+
+from common import report, sentence, time_calls
+
+TEMPLATE = Template('<h1>{{ title }}</h1><div class="post-content">{{ html|safe }}</div>')
+
+CODE = '''```python
+def fetch_page(cursor, page_size=10):
+    rows = db.query_all("SELECT id, title FROM posts WHERE id < %s "
+                        "ORDER BY id DESC LIMIT %s", (cursor, page_size))
+    return [dict(id=row[0], title=row[1]) for row in rows]
+```'''
+
+
+def technical_post(rng, sections):
+    parts = []
+    for n in range(sections):
+        parts.append('## %s' % sentence(rng, 4).capitalize())
+        parts.append(' '.join(sentence(rng, 20).capitalize() + '.' for _ in range(4)))
+        if n % 2 == 0:
+            parts.append(CODE)
+        if n % 3 == 0:
+            parts.append('| metric | before | after |\n|---|--:|--:|\n' +
+                         '\n'.join('| %s | %d | %d |' % (sentence(rng, 1), rng.randint(1, 999), rng.randint(1, 99))
+                                   for _ in range(5)))
+        parts.append('\n'.join('- %s [link](https://example.com/%d)' % (sentence(rng, 6), i) for i in range(4)))
+    return '\n\n'.join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', default='5,20,80')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    from app.render import render_markdown
+
+    rng = random.Random(42)
+    for sections in [int(s) for s in args.sections.split(',')]:
+        content = technical_post(rng, sections)
+        stored = render_markdown(content)
+        label = '%d sections (%d KB)' % (sections, len(content) // 1024)
+        report(label + ', render on read',
+               time_calls(lambda: TEMPLATE.render(title='Post', html=render_markdown(content)), args.repeat))
+        report(label + ', stored HTML',
+               time_calls(lambda: TEMPLATE.render(title='Post', html=stored), args.repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Search latency over a synthetic corpus, without MySQL.
+
+Builds a SearchIndex over --posts generated posts. Their words follow a
+Zipf distribution, like real prose, and each post leans on the vocabulary
+of one topic. It then times typical queries: common and rare words, several
+words from one topic or across topics, and a prefix being typed. The target
+is a p99 under 20ms on 100k posts:
+
+    python bench/bench_search.py --posts 100000
+"""
+import argparse
+import itertools
+import random
+import string
+import time
+
+from common import WORDS, report, time_calls
+
+QUERIES = ('python', 'flask cache', 'mysql index latency', 'deploy docker cluster', 'pyt', 'templ',
+           'the worker', 'kernel socket buffer memory', 'python kernel docker')
+TOPICS = (
+    'python flask template render request response cache page'.split(),
+    'mysql index query cursor latency page cache'.split(),
+    'kernel network socket buffer memory disk thread'.split(),
+    'deploy docker cluster metric trace worker pool'.split(),
+)
+TOPIC_SHARE = 0.15
+
+
+def vocabulary(rng, size):
+    words = set(WORDS)
+    while len(words) < size:
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))))
+    # Put the familiar words first so they are the frequent ones.
+    return list(WORDS) + sorted(words - set(WORDS))
+
+
+def corpus(count, vocab_size, seed=42):
+    rng = random.Random(seed)
+    words = vocabulary(rng, vocab_size)
+    cum_weights = list(itertools.accumulate(1.0 / rank for rank in range(1, len(words) + 1)))
+    def text(topic, length):
+        tokens = rng.choices(words, cum_weights=cum_weights, k=length)
+        for i in range(length):
+            if rng.random() < TOPIC_SHARE:
+                tokens[i] = rng.choice(topic)
+        return ' '.join(tokens)
+
+    for doc_id in range(1, count + 1):
+        topic = rng.choice(TOPICS)
+        yield doc_id, text(topic, 6), text(topic, rng.randint(50, 400))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    from app.search import SearchIndex
+
+    index = SearchIndex()
+    started = time.perf_counter()
+    for doc_id, title, content in corpus(args.posts, args.vocabulary):
+        index.add(doc_id, title, content)
+    index.finish_build()
+    print('Indexed %d posts in %.1fs' % (len(index), time.perf_counter() - started))
+
+    everything = []
+    for query in QUERIES:
+        samples = time_calls(lambda: index.search(query), args.repeat)
+        everything.extend(samples)
+        report('%r' % query, samples)
+    report('all queries', everything)
+
+    started = time.perf_counter()
+    for doc_id, title, content in corpus(100, args.vocabulary, seed=7):
+        index.add(doc_id, title, content)
+    print('Re-indexed 100 posts in %.1fms' % ((time.perf_counter() - started) * 1000))
+
+if __name__ == '__main__':
+    main()
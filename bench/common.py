@@ -0,0 +1,79 @@
+"""Helpers shared by the benchmark scripts in this directory.
+
+The MySQL benchmarks seed a separate database (``tech_blog_bench`` by
+default, ``tech_blog_bench_authors`` for bench_authors.py) so they never
+touch real content. Create it once with ``CREATE DATABASE tech_blog_bench``
+and pass ``--database`` to use another.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ('python flask mysql index query cache latency thread pool worker request response '
+         'template render markdown search token prefix cursor page author post feed sitemap '
+         'kernel network socket buffer memory disk compile deploy docker cluster metric trace '
+         'the a of to and in is for on with that this it as be by').split()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def report(label, samples):
+    print('%-40s n=%-6d p50=%8.3fms  p99=%8.3fms  max=%8.3fms' % (
+        label, len(samples), percentile(samples, 50) * 1000, percentile(samples, 99) * 1000,
+        max(samples) * 1000 if samples else 0))
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def bench_app(database):
+    from app import app
+    app.config['MYSQL_DB'] = database
+    app.config['CACHE_TYPE'] = 'null'
+    return app
+
+
+def seed_users(db, count):
+    db.cursor().executemany('INSERT IGNORE INTO users (username, email, password) VALUES (%s, %s, %s)',
+                            [('bench-user-%d' % i, 'bench-user-%d@example.com' % i, 'x')
+                             for i in range(count)])
+    db.commit()
+    return [row[0] for row in db.query_all("SELECT id FROM users WHERE username LIKE 'bench-user-%%' "
+                                           'ORDER BY id LIMIT %s', (count,))]
+
+
+def seed_posts(db, target, author_ids, batch_size=5000, seed=42):
+    """Insert synthetic posts until the table holds `target` rows."""
+    rng = random.Random(seed)
+    existing = db.query_one('SELECT COUNT(*) FROM posts')[0]
+    started_at = datetime(2015, 1, 1) + timedelta(minutes=existing)
+    for offset in range(existing, target, batch_size):
+        rows = []
+        for n in range(offset, min(offset + batch_size, target)):
+            content = sentence(rng, rng.randint(50, 400))
+            rows.append((sentence(rng, 6), content, content[:200], 'bench-%d' % n,
+                         rng.choice(author_ids), started_at + timedelta(minutes=n - existing)))
+        db.cursor().executemany('INSERT INTO posts (title, content, excerpt, slug, author_id, created_at) '
+                                'VALUES (%s, %s, %s, %s, %s, %s)', rows)
+        db.commit()
+    return target
@@ -6,3 +6,48 @@ class Config:
     MYSQL_USER = 'root'
     MYSQL_PASSWORD = ''
     MYSQL_DB = 'tech_blog'
+
+    # Connection pool shared by all requests in a worker process
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME') or 3600)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 5)
+    DB_POOL_HEALTH_CHECK = int(os.environ.get('DB_POOL_HEALTH_CHECK') or 30)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 30)
+
+    # Rendered page cache: 'lru' (in-process), 'filesystem' or 'null'.
+    # Invalidations reach every process through marker files in
+    # CACHE_INVALIDATION_DIR, which all workers (and CLI commands) must
+    # share; CACHE_MAX_BYTES caps either backend.
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'lru'
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    CACHE_TTL = int(os.environ.get('CACHE_TTL') or 300)
+    CACHE_DIR = os.environ.get('CACHE_DIR')
+    CACHE_INVALIDATION_DIR = os.environ.get('CACHE_INVALIDATION_DIR')
+
+    # Snapshot written by `flask reindex` and loaded by each worker on first search
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH')
+    # How often each worker re-indexes posts other processes have written
+    SEARCH_CATCH_UP_INTERVAL = float(os.environ.get('SEARCH_CATCH_UP_INTERVAL') or 5)
+
+    # Background jobs for post-write side effects
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS') or 2)
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS') or 5)
+    JOBS_BACKOFF = float(os.environ.get('JOBS_BACKOFF') or 1)
+    JOBS_PERSISTENT = os.environ.get('JOBS_PERSISTENT', '').lower() in ('1', 'true', 'yes')
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL') or 5)
+
+    # Request profiling and SQL instrumentation, exposed at /metrics
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    INSTRUMENTATION_N_PLUS_ONE = int(os.environ.get('INSTRUMENTATION_N_PLUS_ONE') or 5)
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS') or 500)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # /metrics answers only requests with "Authorization: Bearer
+    # <METRICS_TOKEN>" or from METRICS_ALLOWED_IPS (comma separated), and is
+    # not registered when neither is set
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_ALLOWED_IPS = (os.environ.get('METRICS_ALLOWED_IPS') or '').split(',')
+
+    # Pre-generated feeds and sitemaps
+    SITE_URL = os.environ.get('SITE_URL') or 'http://localhost:5000'
+    FEEDS_DIR = os.environ.get('FEEDS_DIR')
@@ -2,6 +2,7 @@
 USE tech_blog;
 
 -- Drop the tables if they exist to avoid conflicts
+DROP TABLE IF EXISTS jobs;
 DROP TABLE IF EXISTS posts;
 DROP TABLE IF EXISTS users;
 
@@ -10,7 +11,9 @@ CREATE TABLE users (
     id INT AUTO_INCREMENT PRIMARY KEY,
     username VARCHAR(50) NOT NULL UNIQUE,
     email VARCHAR(100) NOT NULL UNIQUE,
-    password VARCHAR(200) NOT NULL
+    password VARCHAR(200) NOT NULL,
+    -- Kept in step with posts by the write paths
+    post_count INT NOT NULL DEFAULT 0
 );
 
 -- Create the posts table
@@ -20,11 +23,36 @@ CREATE TABLE posts (
     content TEXT NOT NULL,
     author_id INT NOT NULL,
     slug VARCHAR(255) UNIQUE NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    -- FOREIGN KEY (author_id) REFERENCES users(id)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    excerpt VARCHAR(255) NOT NULL DEFAULT '',
+    -- Sanitized HTML rendered from the Markdown in content on save
+    content_html MEDIUMTEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- Keyset pagination for the index feed
+    INDEX idx_posts_created_at_id (created_at, id),
+    -- Author pages and dashboard listings
+    INDEX idx_posts_author_created_at (author_id, created_at),
+    -- Search index catch-up after loading a snapshot
+    INDEX idx_posts_updated_at (updated_at),
+    FOREIGN KEY (author_id) REFERENCES users(id)
 );
 
 CREATE TABLE pages (
     slug VARCHAR(255) PRIMARY KEY,
     content TEXT
 );
+
+-- Persistent background jobs (used when JOBS_PERSISTENT is set)
+CREATE TABLE jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key VARCHAR(191) UNIQUE,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    run_at DATETIME NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_jobs_status_run_at (status, run_at)
+);
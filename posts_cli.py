@@ -0,0 +1,256 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime, timezone
+
+import MySQLdb.cursors
+
+from app import app, db, models, page_cache
+from app.render import render_post
+from app.routes import generate_slug
+
+EXPORT_COLUMNS = ('id', 'title', 'slug', 'content', 'author_id', 'created_at')
+TITLE_MAX_LENGTH = 255
+CONTENT_MAX_BYTES = 65535  # posts.content is TEXT
+
+
+# Readers yield one dict per post so a file is never loaded whole. A
+# record that cannot be parsed is yielded as a ValueError, so it is
+# reported and skipped like any other invalid post.
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield ValueError('invalid JSON, %s' % e)
+                continue
+            yield record if isinstance(record, dict) else ValueError('line is not a JSON object')
+
+def read_csv(path):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, encoding='utf-8', newline='') as f:
+        yield from csv.DictReader(f)
+
+def parse_markdown(text):
+    post = {}
+    lines = text.splitlines()
+    if lines and lines[0].strip() == '---':
+        for i, line in enumerate(lines[1:], 1):
+            if line.strip() == '---':
+                lines = lines[i + 1:]
+                break
+            key, _, value = line.partition(':')
+            post[key.strip()] = value.strip().strip('"\'')
+    post['content'] = '\n'.join(lines).strip()
+    return post
+
+def read_markdown(path):
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(('.md', '.markdown')):
+                    yield from read_markdown(os.path.join(root, name))
+        return
+    with open(path, encoding='utf-8') as f:
+        yield parse_markdown(f.read())
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv, 'markdown': read_markdown}
+
+def detect_format(path):
+    if os.path.isdir(path):
+        return 'markdown'
+    ext = os.path.splitext(path)[1].lower()
+    return {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv',
+            '.md': 'markdown', '.markdown': 'markdown'}.get(ext)
+
+
+def parse_created_at(value):
+    # Stored timestamps are naive UTC (feeds.py reads them that way), so an
+    # offset is converted rather than dropped.
+    if not value:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def slug_variant(base, n):
+    return base if n == 1 else '%s-%d' % (base, n)
+
+def slug_key(slug):
+    # The posts.slug collation is case and accent insensitive, so "café"
+    # and "Cafe" collide on the UNIQUE index; compare slugs the same way.
+    decomposed = unicodedata.normalize('NFKD', slug.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def resolve_slugs(cursor, bases):
+    # Picks a free slug for every post in the batch with at most two queries:
+    # one for exact matches, one for the numbered variants of the bases
+    # that collided.
+    counts = Counter(bases)
+    placeholders = ', '.join(['%s'] * len(counts))
+    cursor.execute('SELECT slug FROM posts WHERE slug IN (%s)' % placeholders, tuple(counts))
+    taken = {slug_key(row[0]) for row in cursor.fetchall()}
+    key_counts = Counter(slug_key(base) for base in bases)
+    duplicated = {base for base in counts if slug_key(base) in taken or key_counts[slug_key(base)] > 1}
+    if duplicated:
+        patterns = [base.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '-%'
+                    for base in duplicated]
+        cursor.execute('SELECT slug FROM posts WHERE ' + ' OR '.join(['slug LIKE %s'] * len(patterns)),
+                       tuple(patterns))
+        taken.update(slug_key(row[0]) for row in cursor.fetchall())
+    slugs = []
+    for base in bases:
+        n = 1
+        while slug_key(slug_variant(base, n)) in taken:
+            n += 1
+        slug = slug_variant(base, n)
+        taken.add(slug_key(slug))
+        slugs.append(slug)
+    return slugs
+
+def insert_batch(batch):
+    cursor = db.cursor()
+    slugs = resolve_slugs(cursor, [post['slug'] for post in batch])
+    rows = []
+    for post, slug in zip(batch, slugs):
+        content_html, excerpt = render_post(post['content'])
+        rows.append((post['title'], post['content'], content_html, excerpt, slug,
+                     post['author_id'], post['created_at']))
+    cursor.executemany('INSERT INTO posts (title, content, content_html, excerpt, slug, author_id, created_at) '
+                       'VALUES (%s, %s, %s, %s, %s, %s, %s)', rows)
+    models.add_post_counts(Counter(post['author_id'] for post in batch))
+    db.commit()
+
+def author_exists(author_id, known):
+    # known caches the answer per id so each author is looked up once.
+    if author_id not in known:
+        known[author_id] = db.query_one('SELECT 1 FROM users WHERE id = %s', (author_id,)) is not None
+    return known[author_id]
+
+def normalize(record, default_author_id, known_authors):
+    if isinstance(record, ValueError):
+        raise record
+    for field in ('title', 'content', 'body', 'slug'):
+        if record.get(field) is not None and not isinstance(record[field], str):
+            raise ValueError('%s must be a string' % field)
+    title = (record.get('title') or '').strip()
+    content = record.get('content') or record.get('body') or ''
+    if not title or not content:
+        raise ValueError('post needs a title and content')
+    if len(title) > TITLE_MAX_LENGTH:
+        raise ValueError('title is longer than %d characters' % TITLE_MAX_LENGTH)
+    if len(content.encode('utf-8')) > CONTENT_MAX_BYTES:
+        raise ValueError('content is longer than %d bytes' % CONTENT_MAX_BYTES)
+    author_id = record.get('author_id') or default_author_id
+    if not author_id:
+        raise ValueError('post has no author_id and no --author-id was given')
+    try:
+        author_id = int(author_id)
+    except (TypeError, ValueError):
+        raise ValueError('author_id must be an integer')
+    if not author_exists(author_id, known_authors):
+        raise ValueError('author %d does not exist' % author_id)
+    return {
+        'title': title,
+        'content': content,
+        'slug': generate_slug(record.get('slug') or title)[:240] or 'post',
+        'author_id': author_id,
+        'created_at': parse_created_at(record.get('created_at') or record.get('date')),
+    }
+
+def import_posts(args):
+    imported = skipped = 0
+    started = time.monotonic()
+    batch = []
+    known_authors = {}
+    for path in args.paths:
+        fmt = args.format or detect_format(path)
+        if fmt not in READERS:
+            sys.exit('Cannot tell the format of %s; pass --format' % path)
+        for line_no, record in enumerate(READERS[fmt](path), 1):
+            try:
+                batch.append(normalize(record, args.author_id, known_authors))
+            except ValueError as e:
+                skipped += 1
+                print('%s:%d: skipped, %s' % (path, line_no, e), file=sys.stderr)
+                continue
+            if len(batch) >= args.batch_size:
+                insert_batch(batch)
+                imported += len(batch)
+                batch = []
+                report_progress('imported', imported, started)
+    if batch:
+        insert_batch(batch)
+        imported += len(batch)
+    report_progress('imported', imported, started)
+    page_cache.clear()
+    print('Done: %d imported, %d skipped. Run `flask reindex` and `flask build-feeds` to refresh search and feeds.' % (imported, skipped),
+          file=sys.stderr)
+
+
+def export_posts(args):
+    fmt = args.format or detect_format(args.output) or 'jsonl'
+    started = time.monotonic()
+    # SSCursor streams rows from the server instead of buffering the result.
+    cursor = db.connection.cursor(MySQLdb.cursors.SSCursor)
+    cursor.execute('SELECT ' + ', '.join(EXPORT_COLUMNS) + ' FROM posts ORDER BY id')
+    exported = 0
+    with open(args.output, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+        for row in cursor:
+            row = row[:-1] + (row[-1].isoformat(),)
+            if writer:
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n')
+            exported += 1
+            if exported % args.batch_size == 0:
+                report_progress('exported', exported, started)
+    cursor.close()
+    report_progress('exported', exported, started)
+
+
+def report_progress(verb, count, started):
+    elapsed = time.monotonic() - started
+    rate = count / elapsed if elapsed else 0
+    print('%s %d posts (%.0f/s)' % (verb, count, rate), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import and export blog posts.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('import', help='import posts from JSONL, CSV or Markdown files')
+    p.add_argument('paths', nargs='+', help='files, or directories of Markdown files')
+    p.add_argument('--format', choices=sorted(READERS))
+    p.add_argument('--author-id', type=int, help='author for posts that do not set author_id')
+    p.add_argument('--batch-size', type=int, default=1000)
+    p.set_defaults(func=import_posts)
+
+    p = subparsers.add_parser('export', help='export all posts to JSONL or CSV')
+    p.add_argument('output')
+    p.add_argument('--format', choices=['jsonl', 'csv'])
+    p.add_argument('--batch-size', type=int, default=10000, help='progress reporting interval')
+    p.set_defaults(func=export_posts)
+
+    args = parser.parse_args(argv)
+    with app.app_context():
+        args.func(args)
+
+
+if __name__ == '__main__':
+    main()
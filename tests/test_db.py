@@ -0,0 +1,150 @@
+import MySQLdb
+import pytest
+
+from app.db import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, fail_ping=False, fail_rollback=False):
+        self.fail_ping = fail_ping
+        self.fail_rollback = fail_rollback
+        self.closed = False
+        self.pings = 0
+
+    def ping(self):
+        self.pings += 1
+        if self.fail_ping:
+            raise MySQLdb.OperationalError(2006, 'MySQL server has gone away')
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise MySQLdb.OperationalError(2013, 'Lost connection to MySQL server')
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def connections():
+    return []
+
+
+@pytest.fixture
+def make_pool(connections, clock):
+    def make_pool(**kwargs):
+        def connect():
+            conn = FakeConnection()
+            connections.append(conn)
+            return conn
+        return ConnectionPool(connect, clock=clock, **kwargs)
+    return make_pool
+
+
+def test_reuses_released_connection(make_pool, connections):
+    pool = make_pool()
+    pooled = pool.acquire()
+    assert pool.in_use == 1
+    pool.release(pooled)
+    assert pool.in_use == 0
+    assert pool.idle() == 1
+    assert pool.acquire().conn is connections[0]
+    assert len(connections) == 1
+
+
+def test_acquire_times_out_when_exhausted(make_pool):
+    pool = make_pool(max_size=1, checkout_timeout=0.01)
+    pooled = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(pooled)
+    assert pool.acquire() is pooled
+
+
+def test_failed_connect_frees_slot():
+    def connect():
+        raise MySQLdb.OperationalError(2003, "Can't connect to MySQL server")
+    pool = ConnectionPool(connect, max_size=1, checkout_timeout=0.01)
+    for _ in range(2):
+        with pytest.raises(MySQLdb.OperationalError):
+            pool.acquire()
+    assert pool.in_use == 0
+
+
+def test_expired_idle_connection_is_replaced(make_pool, connections, clock):
+    pool = make_pool(max_lifetime=60, health_check_interval=3600)
+    pool.release(pool.acquire())
+    clock.now += 61
+    pooled = pool.acquire()
+    assert connections[0].closed
+    assert pooled.conn is connections[1]
+
+
+def test_release_closes_connection_past_lifetime(make_pool, connections, clock):
+    pool = make_pool(max_lifetime=60)
+    pooled = pool.acquire()
+    clock.now += 61
+    pool.release(pooled)
+    assert connections[0].closed
+    assert pool.idle() == 0
+    assert pool.in_use == 0
+
+
+def test_stale_connection_is_pinged(make_pool, connections, clock):
+    pool = make_pool(health_check_interval=30)
+    pool.release(pool.acquire())
+    clock.now += 10
+    pool.release(pool.acquire())
+    assert connections[0].pings == 0
+    clock.now += 31
+    assert pool.acquire().conn is connections[0]
+    assert connections[0].pings == 1
+
+
+def test_failed_ping_discards_connection(make_pool, connections, clock):
+    pool = make_pool(health_check_interval=30)
+    pool.release(pool.acquire())
+    connections[0].fail_ping = True
+    clock.now += 31
+    pooled = pool.acquire()
+    assert connections[0].closed
+    assert pooled.conn is connections[1]
+
+
+def test_failed_rollback_discards_connection(make_pool, connections):
+    pool = make_pool()
+    pooled = pool.acquire()
+    connections[0].fail_rollback = True
+    pool.release(pooled)
+    assert connections[0].closed
+    assert pool.idle() == 0
+    assert pool.in_use == 0
+
+
+def test_release_with_discard_closes_connection(make_pool, connections):
+    pool = make_pool()
+    pool.release(pool.acquire(), discard=True)
+    assert connections[0].closed
+    assert pool.idle() == 0
+
+
+def test_close_closes_idle_connections(make_pool, connections):
+    pool = make_pool()
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    pool.close()
+    assert all(conn.closed for conn in connections)
+    assert pool.idle() == 0
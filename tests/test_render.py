@@ -0,0 +1,48 @@
+from app.render import EXCERPT_LENGTH, render_markdown, render_post
+
+
+def test_strips_script_tags():
+    html = render_markdown('Hello\n\n<script>alert(1)</script>')
+    assert '<script' not in html
+    assert 'Hello' in html
+
+
+def test_strips_javascript_links():
+    html = render_markdown('[click](javascript:alert(1)) and <a href="javascript:alert(2)">raw</a>')
+    assert 'javascript:' not in html
+    assert 'click' in html and 'raw' in html
+
+
+def test_keeps_safe_links():
+    html = render_markdown('[docs](https://example.com/docs "Docs")')
+    assert '<a href="https://example.com/docs" title="Docs">docs</a>' in html
+
+
+def test_strips_event_handler_attributes():
+    html = render_markdown('<img src="https://example.com/x.png" onerror="alert(1)">\n\n'
+                           '<p onclick="alert(2)" style="color: red">text</p>')
+    assert 'onerror' not in html
+    assert 'onclick' not in html
+    assert 'style=' not in html
+    assert 'src="https://example.com/x.png"' in html
+
+
+def test_keeps_codehilite_markup():
+    html = render_markdown('```python\ndef answer():\n    return 42\n```')
+    assert '<div class="codehilite">' in html
+    assert '<span class="k">def</span>' in html
+    assert '<span class="mi">42</span>' in html
+
+
+def test_keeps_tables():
+    html = render_markdown('| a | b |\n|---|--:|\n| 1 | 2 |')
+    assert '<table>' in html
+    assert '<td align="right">2</td>' in html
+
+
+def test_render_post_excerpt_is_plain_text():
+    content_html, excerpt = render_post('# Title\n\nSome **bold** text & more. ' + 'word ' * 100)
+    assert '<' not in excerpt
+    assert excerpt.startswith('Title Some bold text & more.')
+    assert len(excerpt) <= EXCERPT_LENGTH + len('...')
+    assert '<strong>bold</strong>' in content_html